@@ -1,18 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, event
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import timedelta
 
+from ..core.config import settings
 from ..core.database import get_db
-from ..core.security import verify_password, get_password_hash, create_access_token, verify_token
+from ..core.security import (
+    verify_password_async, get_password_hash_async, create_access_token, verify_token, password_hasher
+)
 from ..models.user import User
+from ..services.cache import TTLCache
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# Authenticated users keyed by token subject, so most requests skip the DB lookup.
+# Entries are detached User instances: read their columns, don't add them to a session.
+user_cache = TTLCache(max_size=settings.AUTH_USER_CACHE_MAX_SIZE, ttl=settings.AUTH_USER_CACHE_TTL)
+
+
+def invalidate_cached_user(username: str):
+    """Drop a user from the authentication cache"""
+    user_cache.delete(username)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    # Any flushed change (profile edit, deactivation) evicts the cached copy
+    invalidate_cached_user(target.username)
+
 
 # Pydantic models
 class UserCreate(BaseModel):
@@ -61,7 +80,7 @@ async def authenticate_user(db: AsyncSession, username: str, password: str) -> O
     if not user:
         user = await get_user_by_email(db, username)
     
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await verify_password_async(password, user.hashed_password):
         return None
     
     return user
@@ -83,10 +102,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     except Exception:
         raise credentials_exception
     
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    
     user = await get_user_by_username(db, username)
     if user is None:
         raise credentials_exception
     
+    user_cache.set(username, user)
     return user
 
 
@@ -109,7 +133,7 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     db_user = User(
         email=user_data.email,
         username=user_data.username,
@@ -128,6 +152,7 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """Login and get access token"""
     user = await authenticate_user(db, form_data.username, form_data.password)
+    password_hasher.record_login(success=user is not None)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -152,10 +177,13 @@ async def update_current_user(
     db: AsyncSession = Depends(get_db)
 ):
     """Update current user information"""
+    # current_user may be a cached, detached copy; update the row through this session
+    user = await db.get(User, current_user.id)
     if full_name is not None:
-        current_user.full_name = full_name
+        user.full_name = full_name
     
     await db.commit()
-    await db.refresh(current_user)
+    await db.refresh(user)
+    invalidate_cached_user(user.username)
     
-    return current_user
+    return user
@@ -1,12 +1,35 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 from datetime import datetime
+import asyncio
+import numpy as np
 
 from ..services.market_data_service import MarketDataService
+from ..services.risk_calculator import RiskCalculator
+from ..services.streaming_metrics import StreamingMetricsRegistry
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow responses are optional
+    pa = None
 
 router = APIRouter()
 
+# Media types for historical data, negotiated through the Accept header
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.portfolio.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+HISTORICAL_MEDIA_TYPES = {
+    "application/json": "json",
+    COLUMNAR_JSON_MEDIA_TYPE: "columnar",
+    ARROW_MEDIA_TYPE: "arrow",
+    BINARY_MEDIA_TYPE: "binary",
+}
+# The body depends on Accept, so shared caches must key on it
+NEGOTIATED_HEADERS = {'Vary': 'Accept'}
+
 
 # Pydantic models
 class PriceResponse(BaseModel):
@@ -26,37 +49,67 @@ class HistoricalDataResponse(BaseModel):
     period_days: int
 
 
+class ColumnarHistoricalDataResponse(BaseModel):
+    symbol: str
+    dates: List[datetime]
+    close: List[float]
+    period_days: int
+
+
+class HistoricalPanelRequest(BaseModel):
+    symbols: List[str]
+    days: int = 252
+
+
+class HistoricalPanelResponse(BaseModel):
+    symbols: List[str]
+    dates: List[datetime]
+    close: Dict[str, List[float]]
+    period_days: int
+    missing: List[str]
+
+
 class MultiPriceResponse(BaseModel):
     prices: Dict[str, float]
     timestamp: datetime
 
 
+def get_market_service(request: Request) -> MarketDataService:
+    """Dependency returning the process-wide market data service"""
+    return request.app.state.market_service
+
+
+def get_streaming_metrics(request: Request) -> StreamingMetricsRegistry:
+    """Dependency returning the intraday streaming metrics registry"""
+    return request.app.state.streaming_metrics
+
+
 @router.get("/price/{symbol}", response_model=PriceResponse)
-async def get_current_price(symbol: str):
+async def get_current_price(
+    symbol: str,
+    market_service: MarketDataService = Depends(get_market_service)
+):
     """Get current price for a single symbol"""
-    market_service = MarketDataService()
+    price = await market_service.get_current_price(symbol.upper())
     
-    try:
-        price = await market_service.get_current_price(symbol.upper())
-        
-        if price is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Price data not found for symbol: {symbol}"
-            )
-        
-        return PriceResponse(
-            symbol=symbol.upper(),
-            price=price,
-            timestamp=datetime.now()
+    if price is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Price data not found for symbol: {symbol}"
         )
-        
-    finally:
-        await market_service.close()
+    
+    return PriceResponse(
+        symbol=symbol.upper(),
+        price=price,
+        timestamp=datetime.now()
+    )
 
 
 @router.post("/prices", response_model=MultiPriceResponse)
-async def get_multiple_prices(symbols: List[str]):
+async def get_multiple_prices(
+    symbols: List[str],
+    market_service: MarketDataService = Depends(get_market_service)
+):
     """Get current prices for multiple symbols"""
     if not symbols:
         raise HTTPException(
@@ -70,62 +123,166 @@ async def get_multiple_prices(symbols: List[str]):
             detail="Maximum 50 symbols allowed per request"
         )
     
-    market_service = MarketDataService()
-    
-    try:
-        # Convert to uppercase
-        symbols_upper = [symbol.upper() for symbol in symbols]
-        
-        prices = await market_service.get_multiple_prices(symbols_upper)
-        
-        return MultiPriceResponse(
-            prices=prices,
-            timestamp=datetime.now()
-        )
-        
-    finally:
-        await market_service.close()
+    # Convert to uppercase
+    symbols_upper = [symbol.upper() for symbol in symbols]
+    
+    prices = await market_service.get_multiple_prices(symbols_upper)
+    
+    return MultiPriceResponse(
+        prices=prices,
+        timestamp=datetime.now()
+    )
 
 
-@router.get("/historical/{symbol}", response_model=HistoricalDataResponse)
+@router.get(
+    "/historical/{symbol}",
+    response_model=HistoricalDataResponse,
+    responses={
+        200: {
+            "description": "Rows as JSON by default; columnar JSON, Arrow IPC or raw binary per the Accept header",
+            "content": {
+                COLUMNAR_JSON_MEDIA_TYPE: {"schema": ColumnarHistoricalDataResponse.model_json_schema()},
+                ARROW_MEDIA_TYPE: {},
+                BINARY_MEDIA_TYPE: {},
+            },
+        }
+    },
+)
 async def get_historical_data(
     symbol: str,
-    days: int = 252  # Default to 1 year of trading days
+    days: int = 252,  # Default to 1 year of trading days
+    accept: Optional[str] = Header(None),
+    market_service: MarketDataService = Depends(get_market_service)
 ):
-    """Get historical price data for a symbol"""
+    """Get historical price data for a symbol
+    
+    The Accept header selects the format: application/json (rows, default),
+    the columnar JSON type (parallel dates[]/close[] arrays), Arrow IPC stream,
+    or application/octet-stream (n int64 epoch-ms dates then n float64 closes,
+    little-endian, with the row count in X-Rows).
+    """
     if days < 1 or days > 2000:  # Reasonable limits
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Days must be between 1 and 2000"
         )
     
-    market_service = MarketDataService()
+    response_format = _negotiate_historical_format(accept)
     
-    try:
-        historical_df = await market_service.get_historical_data(symbol.upper(), days)
-        
-        if historical_df.empty:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Historical data not found for symbol: {symbol}"
-            )
-        
-        # Convert DataFrame to response format
-        data_points = []
-        for _, row in historical_df.iterrows():
-            data_points.append(HistoricalDataPoint(
-                date=row['date'],
-                close=row['close']
-            ))
-        
-        return HistoricalDataResponse(
-            symbol=symbol.upper(),
-            data=data_points,
-            period_days=len(data_points)
+    historical_df = await market_service.get_historical_data(symbol.upper(), days)
+    
+    if historical_df.empty:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Historical data not found for symbol: {symbol}"
+        )
+    
+    # Build the response straight from the column buffers, no per-row models
+    dates = historical_df['date'].to_numpy().astype('datetime64[ms]')
+    columns = {'close': historical_df['close'].to_numpy(dtype=np.float64)}
+    return _columnar_response(response_format, dates, columns, {'symbol': symbol.upper()})
+
+
+@router.post(
+    "/historical",
+    response_model=HistoricalPanelResponse,
+    responses={
+        200: {
+            "description": "Columnar JSON by default; Arrow IPC or raw binary per the Accept header",
+            "content": {ARROW_MEDIA_TYPE: {}, BINARY_MEDIA_TYPE: {}},
+        }
+    },
+)
+async def get_historical_panel(
+    panel_request: HistoricalPanelRequest,
+    accept: Optional[str] = Header(None),
+    market_service: MarketDataService = Depends(get_market_service)
+):
+    """Get date-aligned historical closes for several symbols in one request
+    
+    Histories are fetched concurrently and aligned on the dates every symbol
+    has, as for portfolio returns. JSON responses are columnar (dates[] plus a
+    close[] array per symbol); Arrow has one column per symbol and binary
+    holds the int64 epoch-ms dates followed by each symbol's float64 closes.
+    """
+    if not panel_request.symbols:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least one symbol is required"
+        )
+    
+    if len(panel_request.symbols) > 50:  # Limit to prevent abuse
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Maximum 50 symbols allowed per request"
         )
-        
-    finally:
-        await market_service.close()
+    
+    if panel_request.days < 1 or panel_request.days > 2000:  # Reasonable limits
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Days must be between 1 and 2000"
+        )
+    
+    response_format = _negotiate_historical_format(accept)
+    
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in panel_request.symbols))
+    histories = await asyncio.gather(*[
+        market_service.get_historical_data(symbol, panel_request.days) for symbol in symbols
+    ])
+    
+    # Daily closes keyed by calendar date so providers' timestamps line up
+    risk_calculator = RiskCalculator()
+    asset_prices = {
+        symbol: risk_calculator.close_series(historical_df)
+        for symbol, historical_df in zip(symbols, histories)
+        if not historical_df.empty
+    }
+    
+    missing = [symbol for symbol in symbols if symbol not in asset_prices]
+    if not asset_prices:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Historical data not found for any requested symbol"
+        )
+    
+    panel = risk_calculator.align_prices(asset_prices)
+    dates = panel.index.to_numpy().astype('datetime64[ms]')
+    columns = {symbol: panel[symbol].to_numpy(dtype=np.float64) for symbol in panel.columns}
+    
+    if response_format in ("json", "columnar"):
+        return JSONResponse(
+            content={
+                'symbols': list(columns),
+                'dates': np.datetime_as_string(dates, unit='ms').tolist(),
+                'close': {symbol: values.tolist() for symbol, values in columns.items()},
+                'period_days': len(dates),
+                'missing': missing
+            },
+            media_type=COLUMNAR_JSON_MEDIA_TYPE if response_format == "columnar" else "application/json",
+            headers=NEGOTIATED_HEADERS
+        )
+    
+    return _columnar_response(
+        response_format, dates, columns, {'symbols': ",".join(columns), 'missing': ",".join(missing)}
+    )
+
+
+@router.post("/intraday-risk")
+async def get_intraday_risk(
+    symbols: List[str],
+    streaming_metrics: StreamingMetricsRegistry = Depends(get_streaming_metrics)
+):
+    """Get streaming intraday risk metrics for symbols tracked by the price feed"""
+    if len(symbols) > 50:  # Limit to prevent abuse
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Maximum 50 symbols allowed per request"
+        )
+    
+    return {
+        'metrics': streaming_metrics.get_snapshot([symbol.upper() for symbol in symbols]),
+        'timestamp': datetime.now()
+    }
 
 
 @router.get("/search/{query}")
@@ -204,6 +361,12 @@ async def search_symbols(query: str):
     }
 
 
+@router.get("/cache-stats")
+async def get_cache_stats(market_service: MarketDataService = Depends(get_market_service)):
+    """Get hit/miss counters for the shared market data caches"""
+    return market_service.get_cache_stats()
+
+
 @router.get("/market-status")
 async def get_market_status():
     """Get current market status"""
@@ -228,3 +391,87 @@ async def get_market_status():
         'next_open': 'Next business day 9:30 AM ET' if not market_open else None,
         'next_close': '4:00 PM ET today' if market_open else None
     }
+
+
+# Helper functions
+def _negotiate_historical_format(accept: Optional[str]) -> str:
+    """Pick the historical data format from an Accept header (highest q wins)"""
+    if not accept:
+        return "json"
+    
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, position, media_type.lower()))
+    
+    for negative_quality, _, media_type in sorted(candidates):
+        if negative_quality >= 0:
+            break
+        if media_type in HISTORICAL_MEDIA_TYPES:
+            return HISTORICAL_MEDIA_TYPES[media_type]
+        if media_type in ("*/*", "application/*"):
+            return "json"
+    
+    raise HTTPException(
+        status_code=status.HTTP_406_NOT_ACCEPTABLE,
+        detail=f"Supported media types: {', '.join(HISTORICAL_MEDIA_TYPES)}"
+    )
+
+
+def _columnar_response(response_format: str,
+                       dates: np.ndarray,
+                       columns: Dict[str, np.ndarray],
+                       meta: Dict) -> Response:
+    """Encode datetime64[ms] dates plus float64 columns in the negotiated format"""
+    if response_format == "arrow":
+        if pa is None:
+            raise HTTPException(
+                status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                detail="Arrow responses require pyarrow on the server"
+            )
+        table = pa.table(
+            {'date': pa.array(dates), **{name: pa.array(values) for name, values in columns.items()}},
+            metadata={key: str(value) for key, value in meta.items()}
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(
+            content=sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE, headers=NEGOTIATED_HEADERS
+        )
+    
+    if response_format == "binary":
+        buffers = [dates.astype('<i8').tobytes()]
+        buffers.extend(values.astype('<f8').tobytes() for values in columns.values())
+        return Response(
+            content=b"".join(buffers),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={
+                **NEGOTIATED_HEADERS,
+                'X-Rows': str(len(dates)),
+                'X-Columns': ",".join(['date', *columns]),
+                **{f"X-{key.replace('_', '-').title()}": str(value) for key, value in meta.items()},
+            }
+        )
+    
+    iso_dates = np.datetime_as_string(dates, unit='ms').tolist()
+    if response_format == "columnar":
+        content = {**meta, 'dates': iso_dates}
+        content.update({name: values.tolist() for name, values in columns.items()})
+        content['period_days'] = len(iso_dates)
+        return JSONResponse(content=content, media_type=COLUMNAR_JSON_MEDIA_TYPE, headers=NEGOTIATED_HEADERS)
+    
+    # Row-oriented JSON, same shape as HistoricalDataResponse
+    (name, values), = columns.items()
+    return JSONResponse(content={
+        **meta,
+        'data': [{'date': date, name: value} for date, value in zip(iso_dates, values.tolist())],
+        'period_days': len(iso_dates)
+    }, headers=NEGOTIATED_HEADERS)
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
@@ -11,11 +12,30 @@ from ..models.user import User
 from ..models.portfolio import Portfolio, PortfolioAsset
 from ..services.market_data_service import MarketDataService
 from ..services.risk_calculator import RiskCalculator
+from ..services.risk_executor import RiskExecutor, RiskExecutorBusy
+from ..services.covariance_cache import CovarianceCache
+from ..services.risk_cache import RiskResultCache
 from .auth import get_current_user
+from .market_data import get_market_service
 
 router = APIRouter()
 
 
+def get_risk_executor(request: Request) -> RiskExecutor:
+    """Dependency returning the process-wide risk calculation executor"""
+    return request.app.state.risk_executor
+
+
+def get_covariance_cache(request: Request) -> CovarianceCache:
+    """Dependency returning the shared covariance matrix cache"""
+    return request.app.state.covariance_cache
+
+
+def get_risk_cache(request: Request) -> RiskResultCache:
+    """Dependency returning the portfolio risk result cache"""
+    return request.app.state.risk_cache
+
+
 # Pydantic models
 class PortfolioAssetCreate(BaseModel):
     symbol: str
@@ -77,13 +97,33 @@ class RiskMetricsResponse(BaseModel):
     cvar_95: float
     max_drawdown: float
     information_ratio: float
+    var: Optional[float] = None
+    cvar: Optional[float] = None
+    var_method: Optional[str] = None
+    confidence_level: Optional[float] = None
+    horizon_days: Optional[int] = None
     last_updated: datetime
 
 
+class CovarianceResponse(BaseModel):
+    portfolio_id: int
+    symbols: List[str]
+    observations: int
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    covariance: List[List[float]]
+    correlation: List[List[float]]
+
+
+class BatchRiskMetricsRequest(BaseModel):
+    portfolio_ids: Optional[List[int]] = None  # None means all of the user's portfolios
+
+
 @router.get("/", response_model=List[PortfolioResponse])
 async def get_portfolios(
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service)
 ):
     """Get all portfolios for the current user"""
     result = await db.execute(
@@ -93,23 +133,17 @@ async def get_portfolios(
     )
     portfolios = result.scalars().all()
     
-    # Enrich with market data
-    market_service = MarketDataService()
-    try:
-        enriched_portfolios = []
-        for portfolio in portfolios:
-            enriched_portfolio = await _enrich_portfolio_with_market_data(portfolio, market_service)
-            enriched_portfolios.append(enriched_portfolio)
-        return enriched_portfolios
-    finally:
-        await market_service.close()
+    # One batched price lookup for every symbol held, then enrich in memory
+    current_prices = await _fetch_portfolio_prices(market_service, portfolios)
+    return [_enrich_portfolio_with_market_data(portfolio, current_prices) for portfolio in portfolios]
 
 
 @router.post("/", response_model=PortfolioResponse)
 async def create_portfolio(
     portfolio_data: PortfolioCreate,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service)
 ):
     """Create a new portfolio"""
     # Create portfolio
@@ -145,18 +179,16 @@ async def create_portfolio(
     portfolio = result.scalar_one()
     
     # Enrich with market data
-    market_service = MarketDataService()
-    try:
-        return await _enrich_portfolio_with_market_data(portfolio, market_service)
-    finally:
-        await market_service.close()
+    current_prices = await _fetch_portfolio_prices(market_service, [portfolio])
+    return _enrich_portfolio_with_market_data(portfolio, current_prices)
 
 
 @router.get("/{portfolio_id}", response_model=PortfolioResponse)
 async def get_portfolio(
     portfolio_id: int,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service)
 ):
     """Get a specific portfolio"""
     result = await db.execute(
@@ -173,11 +205,8 @@ async def get_portfolio(
         )
     
     # Enrich with market data
-    market_service = MarketDataService()
-    try:
-        return await _enrich_portfolio_with_market_data(portfolio, market_service)
-    finally:
-        await market_service.close()
+    current_prices = await _fetch_portfolio_prices(market_service, [portfolio])
+    return _enrich_portfolio_with_market_data(portfolio, current_prices)
 
 
 @router.put("/{portfolio_id}", response_model=PortfolioResponse)
@@ -185,7 +214,8 @@ async def update_portfolio(
     portfolio_id: int,
     portfolio_data: PortfolioUpdate,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service)
 ):
     """Update a portfolio"""
     result = await db.execute(
@@ -211,18 +241,16 @@ async def update_portfolio(
     await db.refresh(portfolio)
     
     # Enrich with market data
-    market_service = MarketDataService()
-    try:
-        return await _enrich_portfolio_with_market_data(portfolio, market_service)
-    finally:
-        await market_service.close()
+    current_prices = await _fetch_portfolio_prices(market_service, [portfolio])
+    return _enrich_portfolio_with_market_data(portfolio, current_prices)
 
 
 @router.delete("/{portfolio_id}")
 async def delete_portfolio(
     portfolio_id: int,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    risk_cache: RiskResultCache = Depends(get_risk_cache)
 ):
     """Delete a portfolio"""
     result = await db.execute(
@@ -239,6 +267,7 @@ async def delete_portfolio(
     
     await db.delete(portfolio)
     await db.commit()
+    risk_cache.invalidate_portfolio(portfolio_id)
     
     return {"message": "Portfolio deleted successfully"}
 
@@ -248,7 +277,9 @@ async def add_asset_to_portfolio(
     portfolio_id: int,
     asset_data: PortfolioAssetCreate,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service),
+    risk_cache: RiskResultCache = Depends(get_risk_cache)
 ):
     """Add an asset to a portfolio"""
     # Verify portfolio ownership
@@ -276,14 +307,11 @@ async def add_asset_to_portfolio(
     db.add(db_asset)
     await db.commit()
     await db.refresh(db_asset)
+    risk_cache.invalidate_portfolio(portfolio_id)
     
     # Enrich with market data
-    market_service = MarketDataService()
-    try:
-        current_price = await market_service.get_current_price(db_asset.symbol)
-        return _enrich_asset_with_market_data(db_asset, current_price)
-    finally:
-        await market_service.close()
+    current_price = await market_service.get_current_price(db_asset.symbol)
+    return _enrich_asset_with_market_data(db_asset, current_price)
 
 
 @router.put("/{portfolio_id}/assets/{asset_id}", response_model=PortfolioAssetResponse)
@@ -292,7 +320,9 @@ async def update_portfolio_asset(
     asset_id: int,
     asset_data: PortfolioAssetCreate,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service),
+    risk_cache: RiskResultCache = Depends(get_risk_cache)
 ):
     """Update a portfolio asset"""
     # Verify portfolio ownership and get asset
@@ -321,14 +351,11 @@ async def update_portfolio_asset(
     
     await db.commit()
     await db.refresh(asset)
+    risk_cache.invalidate_portfolio(portfolio_id)
     
     # Enrich with market data
-    market_service = MarketDataService()
-    try:
-        current_price = await market_service.get_current_price(asset.symbol)
-        return _enrich_asset_with_market_data(asset, current_price)
-    finally:
-        await market_service.close()
+    current_price = await market_service.get_current_price(asset.symbol)
+    return _enrich_asset_with_market_data(asset, current_price)
 
 
 @router.delete("/{portfolio_id}/assets/{asset_id}")
@@ -336,7 +363,8 @@ async def remove_asset_from_portfolio(
     portfolio_id: int,
     asset_id: int,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    risk_cache: RiskResultCache = Depends(get_risk_cache)
 ):
     """Remove an asset from a portfolio"""
     # Verify portfolio ownership and get asset
@@ -359,6 +387,7 @@ async def remove_asset_from_portfolio(
     
     await db.delete(asset)
     await db.commit()
+    risk_cache.invalidate_portfolio(portfolio_id)
     
     return {"message": "Asset removed successfully"}
 
@@ -366,10 +395,41 @@ async def remove_asset_from_portfolio(
 @router.get("/{portfolio_id}/risk-metrics", response_model=RiskMetricsResponse)
 async def get_portfolio_risk_metrics(
     portfolio_id: int,
+    method: str = 'historical',  # VaR/CVaR method: historical, parametric or monte_carlo
+    confidence_level: float = 0.95,
+    horizon_days: int = 1,
+    paths: int = 10000,  # Monte Carlo paths
+    seed: Optional[int] = None,  # Monte Carlo seed for reproducible results
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service),
+    risk_executor: RiskExecutor = Depends(get_risk_executor),
+    covariance_cache: CovarianceCache = Depends(get_covariance_cache),
+    risk_cache: RiskResultCache = Depends(get_risk_cache)
 ):
-    """Get detailed risk metrics for a portfolio"""
+    """Get detailed risk metrics for a portfolio
+    
+    Results are cached per portfolio and parameters, keyed by a fingerprint
+    of the holdings and the price data version (newest bar per symbol).
+    """
+    if method not in ('historical', 'parametric', 'monte_carlo'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Method must be 'historical', 'parametric' or 'monte_carlo'"
+        )
+    
+    if not 0 < confidence_level < 1 or horizon_days < 1 or horizon_days > 252:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Confidence level must be in (0, 1) and horizon between 1 and 252 days"
+        )
+    
+    if paths < 1 or paths > 1000000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Paths must be between 1 and 1000000"
+        )
+    
     result = await db.execute(
         select(Portfolio)
         .where(Portfolio.id == portfolio_id, Portfolio.owner_id == current_user.id)
@@ -384,66 +444,217 @@ async def get_portfolio_risk_metrics(
         )
     
     # Calculate risk metrics
-    market_service = MarketDataService()
     risk_calculator = RiskCalculator()
     
-    try:
-        symbols = [asset.symbol for asset in portfolio.assets]
-        if not symbols:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Portfolio has no assets"
-            )
-        
-        # Get historical data for all assets
-        historical_data = {}
-        weights = {}
-        total_value = 0
-        
-        for asset in portfolio.assets:
-            hist_data = await market_service.get_historical_data(asset.symbol)
-            current_price = await market_service.get_current_price(asset.symbol)
-            
-            if current_price:
-                market_value = asset.quantity * current_price
-                total_value += market_value
-                historical_data[asset.symbol] = hist_data['close']
-        
-        # Calculate weights
-        for asset in portfolio.assets:
-            current_price = await market_service.get_current_price(asset.symbol)
-            if current_price:
-                market_value = asset.quantity * current_price
-                weights[asset.symbol] = market_value / total_value if total_value > 0 else 0
+    symbols = list(dict.fromkeys(asset.symbol for asset in portfolio.assets))
+    if not symbols:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Portfolio has no assets"
+        )
+    
+    holdings = sorted((asset.symbol, asset.quantity) for asset in portfolio.assets)
+    
+    def fingerprint():
+        return risk_cache.fingerprint(holdings, market_service.get_history_versions(symbols + ['SPY']))
+    
+    async def compute():
+        # Prefetch stage: every history, current price and the benchmark, concurrently and once
+        historical_data, market_prices, current_prices = await _prefetch_risk_inputs(
+            market_service, symbols
+        )
         
-        # Get market benchmark (SPY)
-        market_data = await market_service.get_historical_data('SPY')
-        market_prices = market_data['close'] if not market_data.empty else None
+        # Compute stage: pure CPU over the prefetched data
+        weights = _portfolio_weights(portfolio, current_prices)
         
-        # Calculate metrics
-        metrics = risk_calculator.calculate_portfolio_metrics(
-            historical_data, weights, market_prices
+        # Calculate metrics off the event loop (worker processes can't share the covariance cache)
+        metrics = await _run_risk_calculation(
+            risk_executor,
+            risk_calculator.calculate_portfolio_metrics,
+            historical_data, weights, market_prices,
+            method, confidence_level, horizon_days, paths, seed,
+            covariance_cache if risk_executor.mode != 'process' else None
         )
         
         return RiskMetricsResponse(
             portfolio_id=portfolio_id,
+            var_method=method,
+            confidence_level=confidence_level,
+            horizon_days=horizon_days,
             last_updated=datetime.now(),
             **metrics
         )
-        
-    finally:
-        await market_service.close()
+    
+    cache_key = (portfolio_id, method, confidence_level, horizon_days, paths, seed)
+    return await risk_cache.get_or_compute(cache_key, fingerprint, compute)
+
+
+@router.get("/{portfolio_id}/covariance", response_model=CovarianceResponse)
+async def get_portfolio_covariance(
+    portfolio_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service),
+    covariance_cache: CovarianceCache = Depends(get_covariance_cache)
+):
+    """Get the daily-return covariance and correlation matrices of a portfolio's holdings"""
+    result = await db.execute(
+        select(Portfolio)
+        .where(Portfolio.id == portfolio_id, Portfolio.owner_id == current_user.id)
+        .options(selectinload(Portfolio.assets))
+    )
+    portfolio = result.scalar_one_or_none()
+    
+    if not portfolio:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Portfolio not found"
+        )
+    
+    symbols = list(dict.fromkeys(asset.symbol for asset in portfolio.assets))
+    if not symbols:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Portfolio has no assets"
+        )
+    
+    histories = await asyncio.gather(*[market_service.get_historical_data(symbol) for symbol in symbols])
+    risk_calculator = RiskCalculator()
+    historical_data = {
+        symbol: risk_calculator.close_series(hist_data)
+        for symbol, hist_data in zip(symbols, histories)
+        if not hist_data.empty
+    }
+    
+    symbols, index, returns = risk_calculator.build_returns_matrix(historical_data)
+    if len(returns) < 2:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Not enough overlapping price history"
+        )
+    
+    covariance, correlation = covariance_cache.get(symbols, index, returns)
+    return CovarianceResponse(
+        portfolio_id=portfolio_id,
+        symbols=symbols,
+        observations=len(returns),
+        start_date=index[0],
+        end_date=index[-1],
+        covariance=covariance.tolist(),
+        correlation=correlation.tolist()
+    )
+
+
+@router.post("/risk-metrics", response_model=List[RiskMetricsResponse])
+async def get_batch_risk_metrics(
+    request: BatchRiskMetricsRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    market_service: MarketDataService = Depends(get_market_service),
+    risk_executor: RiskExecutor = Depends(get_risk_executor)
+):
+    """Get risk metrics for many portfolios in one call"""
+    query = (
+        select(Portfolio)
+        .where(Portfolio.owner_id == current_user.id)
+        .options(selectinload(Portfolio.assets))
+    )
+    if request.portfolio_ids is not None:
+        query = query.where(Portfolio.id.in_(request.portfolio_ids))
+    
+    result = await db.execute(query)
+    portfolios = result.scalars().all()
+    
+    if not portfolios:
+        return []
+    
+    # Load the union of symbols (and the SPY benchmark) once for every portfolio
+    symbols = sorted({asset.symbol for portfolio in portfolios for asset in portfolio.assets})
+    historical_data, market_prices, current_prices = await _prefetch_risk_inputs(
+        market_service, symbols
+    )
+    weights_list = [_portfolio_weights(portfolio, current_prices) for portfolio in portfolios]
+    
+    risk_calculator = RiskCalculator()
+    all_metrics = await _run_risk_calculation(
+        risk_executor,
+        risk_calculator.calculate_batch_metrics,
+        historical_data, weights_list, market_prices
+    )
+    
+    last_updated = datetime.now()
+    return [
+        RiskMetricsResponse(portfolio_id=portfolio.id, last_updated=last_updated, **metrics)
+        for portfolio, metrics in zip(portfolios, all_metrics)
+    ]
 
 
 # Helper functions
-async def _enrich_portfolio_with_market_data(portfolio: Portfolio, market_service: MarketDataService) -> PortfolioResponse:
+async def _run_risk_calculation(risk_executor: RiskExecutor, fn, *args):
+    """Run a risk calculation on the executor, mapping saturation to 503"""
+    try:
+        return await risk_executor.run(fn, *args)
+    except RiskExecutorBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Risk calculations are busy, please retry shortly"
+        )
+
+
+async def _prefetch_risk_inputs(market_service: MarketDataService, symbols: List[str]):
+    """Fetch histories, current prices and the SPY benchmark concurrently
+
+    Returns (historical closes for priced symbols, benchmark closes or None, current prices).
+    """
+    histories, market_data, current_prices = await asyncio.gather(
+        asyncio.gather(*[market_service.get_historical_data(symbol) for symbol in symbols]),
+        market_service.get_historical_data('SPY'),
+        market_service.get_multiple_prices(symbols)
+    )
+    
+    risk_calculator = RiskCalculator()
+    historical_data = {
+        symbol: risk_calculator.close_series(hist_data)
+        for symbol, hist_data in zip(symbols, histories)
+        if current_prices.get(symbol)
+    }
+    market_prices = risk_calculator.close_series(market_data) if not market_data.empty else None
+    return historical_data, market_prices, current_prices
+
+
+def _portfolio_weights(portfolio: Portfolio, current_prices: Dict[str, Optional[float]]) -> Dict[str, float]:
+    """Market-value weights of a portfolio's assets given current prices"""
+    market_values = {}
+    for asset in portfolio.assets:
+        current_price = current_prices.get(asset.symbol)
+        if current_price:
+            market_values[asset.symbol] = market_values.get(asset.symbol, 0) + asset.quantity * current_price
+    
+    total_value = sum(market_values.values())
+    return {
+        symbol: market_value / total_value if total_value > 0 else 0
+        for symbol, market_value in market_values.items()
+    }
+
+
+async def _fetch_portfolio_prices(market_service: MarketDataService,
+                                  portfolios: List[Portfolio]) -> Dict[str, Optional[float]]:
+    """Current prices for the union of symbols held across the portfolios"""
+    symbols = sorted({asset.symbol for portfolio in portfolios for asset in portfolio.assets})
+    if not symbols:
+        return {}
+    return await market_service.get_multiple_prices(symbols)
+
+
+def _enrich_portfolio_with_market_data(portfolio: Portfolio,
+                                       current_prices: Dict[str, Optional[float]]) -> PortfolioResponse:
     """Enrich portfolio with current market data"""
     enriched_assets = []
     total_value = 0
     total_cost = 0
     
     for asset in portfolio.assets:
-        current_price = await market_service.get_current_price(asset.symbol)
+        current_price = current_prices.get(asset.symbol)
         enriched_asset = _enrich_asset_with_market_data(asset, current_price)
         enriched_assets.append(enriched_asset)
         
@@ -1,12 +1,67 @@
+import time
+from typing import Dict
+
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records checkout wait time, overflow and timeout events"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        overflow_before = self._overflow
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+
+        self.checkouts += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        if self._overflow > max(overflow_before, 0):
+            self.overflow_events += 1
+        return connection
+
+    def stats(self) -> Dict:
+        return {
+            'pool_size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'checkouts': self.checkouts,
+            'avg_wait_ms': 1000 * self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+            'max_wait_ms': 1000 * self.max_wait_seconds,
+            'overflow_events': self.overflow_events,
+            'timeouts': self.timeouts,
+        }
+
+
 # Create async engine
 engine = create_async_engine(
     settings.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://"),
-    echo=settings.DEBUG,
+    echo=settings.DEBUG and settings.DB_ECHO,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
     future=True
 )
 
@@ -28,3 +83,8 @@ async def get_db():
             yield session
         finally:
             await session.close()
+
+
+def get_pool_stats() -> Dict:
+    """Connection pool usage for sizing against real traffic"""
+    return engine.pool.stats()
@@ -1,5 +1,9 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
@@ -19,6 +23,118 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool so hashing never blocks the event loop
+
+    bcrypt releases the GIL, so hashes in the pool run alongside request
+    handling and websocket broadcasts. At most max_concurrency hashes run at
+    once; callers beyond max_queue waiting for a slot are rejected with 503
+    instead of piling up during a login storm.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 64, rate_window: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.rate_window = rate_window
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bcrypt")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.hashes = 0
+        self.rejected = 0
+        self.total_hash_seconds = 0.0
+        self.logins = 0
+        self.failed_logins = 0
+        self._login_times = deque()
+
+    async def _run(self, fn, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        # The slot is released when the hash finishes, not when the caller stops
+        # waiting, so a disconnected client doesn't free a thread that is still busy
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            job = self._executor.submit(fn, *args)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        job.add_done_callback(lambda done: self._call_soon(loop, self._finish, started))
+        return await asyncio.wrap_future(job)
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, callback, *args):
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # Loop already closed during shutdown
+
+    def _finish(self, started: float):
+        self._semaphore.release()
+        self.hashes += 1
+        self.total_hash_seconds += time.perf_counter() - started
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    def record_login(self, success: bool):
+        now = time.monotonic()
+        self.logins += 1
+        if not success:
+            self.failed_logins += 1
+        self._login_times.append(now)
+        while self._login_times and self._login_times[0] < now - self.rate_window:
+            self._login_times.popleft()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        while self._login_times and self._login_times[0] < now - self.rate_window:
+            self._login_times.popleft()
+        return {
+            'max_concurrency': self.max_concurrency,
+            'waiting': self.waiting,
+            'hashes': self.hashes,
+            'rejected': self.rejected,
+            'avg_hash_ms': 1000 * self.total_hash_seconds / self.hashes if self.hashes else 0.0,
+            'logins': self.logins,
+            'failed_logins': self.failed_logins,
+            'logins_per_minute': len(self._login_times) * 60 / self.rate_window,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher(
+    max_concurrency=settings.PASSWORD_HASH_CONCURRENCY,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash off the event loop"""
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password off the event loop"""
+    return await password_hasher.hash(password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -0,0 +1,196 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class _CovarianceEntry:
+    """Rolling covariance of one symbol universe over a fixed number of observations
+
+    Keeps the window of returns plus the running sums S = sum(x) and
+    P = sum(x x'), so sliding the window by one bar is a rank-1 update and a
+    rank-1 downdate of P instead of a full recompute.
+    """
+
+    def __init__(self, symbols: Sequence[str], dates: np.ndarray, returns: np.ndarray):
+        self.symbols = list(symbols)
+        self.positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.rebuild(dates, returns)
+
+    def rebuild(self, dates: np.ndarray, returns: np.ndarray):
+        self.dates = dates.copy()
+        self.returns = np.array(returns, dtype=np.float64, order='C')
+        self.sums = self.returns.sum(axis=0)
+        self.products = self.returns.T @ self.returns
+        self.updates_since_rebuild = 0
+        self._covariance = None
+        self._correlation = None
+
+    def slide(self, dates: np.ndarray, returns: np.ndarray):
+        """Append new bars and drop as many of the oldest ones"""
+        for new in returns:
+            old = self.returns[0]
+            self.sums += new - old
+            self.products += np.outer(new, new) - np.outer(old, old)
+            self.returns = np.roll(self.returns, -1, axis=0)
+            self.returns[-1] = new
+        self.dates = np.concatenate([self.dates[len(dates):], dates])
+        self.updates_since_rebuild += len(returns)
+        self._covariance = None
+        self._correlation = None
+
+    @property
+    def covariance(self) -> np.ndarray:
+        if self._covariance is None:
+            n = len(self.returns)
+            mean = self.sums / n
+            self._covariance = (self.products - n * np.outer(mean, mean)) / (n - 1)
+        return self._covariance
+
+    @property
+    def correlation(self) -> np.ndarray:
+        if self._correlation is None:
+            std = np.sqrt(np.diag(self.covariance))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlation = self.covariance / np.outer(std, std)
+            self._correlation = np.nan_to_num(correlation)
+        return self._correlation
+
+    @property
+    def nbytes(self) -> int:
+        # Window, running sums and the (lazily materialised) cov/corr matrices
+        n = len(self.symbols)
+        return self.returns.nbytes + self.products.nbytes + self.sums.nbytes + 2 * n * n * 8
+
+
+class CovarianceCache:
+    """Covariance and correlation matrices shared across portfolios
+
+    Entries are keyed by symbol universe and window length. A request whose
+    window has moved forward by a few bars is served by rank-1 updates of
+    the cached entry; a request for a subset of a cached universe on the same
+    dates is served by slicing. Least recently used entries are evicted to
+    stay within max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, rebuild_every: int = 64):
+        self.max_bytes = max_bytes
+        self.rebuild_every = rebuild_every
+        self._entries: "OrderedDict[Tuple[Tuple[str, ...], int], _CovarianceEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.slices = 0
+        self.updates = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self,
+            symbols: Sequence[str],
+            index: pd.Index,
+            returns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(covariance, correlation) of the returns matrix columns, in symbols order
+
+        index holds the dates of the rows of returns, oldest first.
+        """
+        dates = np.asarray(index)
+        key = (tuple(symbols), len(dates))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if np.array_equal(entry.dates, dates):
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return entry.covariance, entry.correlation
+                if self._advance(entry, dates, returns):
+                    self.updates += 1
+                    self._entries.move_to_end(key)
+                    return entry.covariance, entry.correlation
+
+            sliced = self._slice_superset(symbols, dates)
+            if sliced is not None:
+                self.slices += 1
+                return sliced
+
+            self.misses += 1
+            if entry is not None:
+                self.nbytes -= entry.nbytes
+                entry.rebuild(dates, returns)
+            else:
+                entry = _CovarianceEntry(symbols, dates, returns)
+            self._store(key, entry)
+            return entry.covariance, entry.correlation
+
+    def submatrix(self,
+                  matrix: np.ndarray,
+                  symbols: Sequence[str],
+                  subset: Sequence[str]) -> np.ndarray:
+        """Rows and columns of a cached matrix for a subset of its symbols"""
+        positions = {symbol: i for i, symbol in enumerate(symbols)}
+        rows = [positions[symbol] for symbol in subset]
+        return matrix[np.ix_(rows, rows)]
+
+    def _advance(self, entry: _CovarianceEntry, dates: np.ndarray, returns: np.ndarray) -> bool:
+        """Slide an entry forward to end on dates[-1]; False if that needs a rebuild"""
+        window = len(dates)
+        if window < 2 or not len(entry.dates) or dates[-1] <= entry.dates[-1]:
+            return False
+
+        # How far the window moved: the cached dates must reappear as a prefix shift
+        shift = int(np.searchsorted(dates, entry.dates[-1], side='right'))
+        shift = window - shift
+        if shift <= 0 or shift > window // 2:
+            return False
+        if not np.array_equal(entry.dates[shift:], dates[:window - shift]):
+            return False
+        if entry.updates_since_rebuild + shift > self.rebuild_every:
+            return False  # Rebuild now and then to shed accumulated rounding error
+
+        entry.slide(dates[window - shift:], returns[window - shift:])
+        return True
+
+    def _slice_superset(self, symbols: Sequence[str], dates: np.ndarray):
+        """Serve a subset of a cached universe aligned on exactly the same dates"""
+        wanted = set(symbols)
+        for key, entry in reversed(self._entries.items()):
+            if key[1] != len(dates) or not wanted.issubset(entry.positions):
+                continue
+            if not np.array_equal(entry.dates, dates):
+                continue
+            self._entries.move_to_end(key)
+            return (
+                self.submatrix(entry.covariance, entry.symbols, symbols),
+                self.submatrix(entry.correlation, entry.symbols, symbols),
+            )
+        return None
+
+    def _store(self, key, entry: _CovarianceEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.slices + self.updates + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'slices': self.slices,
+            'rank1_updates': self.updates,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.slices + self.updates) / lookups if lookups else 0.0,
+        }
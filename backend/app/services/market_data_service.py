@@ -1,47 +1,110 @@
 import asyncio
 import httpx
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from datetime import datetime, timedelta
 import pandas as pd
-import numpy as np
 from ..core.config import settings
+from .cache import TTLCache
+from .singleflight import SingleFlight
+from .price_store import HistoricalPriceStore
+from .redis_cache import RedisMarketCache
+from .mock_data import generate_mock_prices, symbol_rng
+
+# Batch quote provider: takes a chunk of symbols, returns the prices it found
+QuoteProvider = Callable[[List[str]], Awaitable[Dict[str, float]]]
+
+
+class PriceFetchError(Exception):
+    """Upstream quotes failed: a batch errored or came back empty, or the provider refused a request"""
+
+
+class FakeQuoteProvider:
+    """Offline batch quote provider for tests and load runs"""
+    
+    def __init__(self, prices: Optional[Dict[str, float]] = None, default_price: float = 100.0):
+        self.prices = prices or {}
+        self.default_price = default_price
+        self.requests = 0
+    
+    async def __call__(self, symbols: List[str]) -> Dict[str, float]:
+        self.requests += 1
+        return {symbol: self.prices.get(symbol, self.default_price) for symbol in symbols}
 
 
 class MarketDataService:
     """Service for fetching real-time and historical market data"""
     
-    def __init__(self):
+    def __init__(self,
+                 quote_provider: Optional[QuoteProvider] = None,
+                 shared_cache: Optional[RedisMarketCache] = None):
         self.client = httpx.AsyncClient(timeout=30.0)
-        self.cache = {}  # Simple in-memory cache
-        self.cache_ttl = 60  # Cache for 60 seconds
+        self.quote_provider = quote_provider
+        # Cross-worker cache consulted after the local one
+        self.shared_cache = shared_cache
+        self.batch_size = settings.PRICE_BATCH_SIZE
+        # Bound how many batch requests are in flight at once
+        self.batch_semaphore = asyncio.Semaphore(settings.PRICE_BATCH_CONCURRENCY)
+        self.batch_requests = 0
+        # Every quote request actually sent upstream (batch or single), for rate budgets
+        self.quote_requests = 0
+        self.failed_batches = 0
+        self.cache_ttl = settings.PRICE_CACHE_TTL
+        self.price_cache = TTLCache(max_size=settings.PRICE_CACHE_MAX_SIZE, ttl=self.cache_ttl)
+        # Concurrent requests for the same key share one upstream call
+        self.flights = SingleFlight()
+        # Local bar store: only the missing tail is fetched upstream
+        self.history_store = (
+            HistoricalPriceStore(settings.HISTORY_STORE_DIR) if settings.HISTORY_STORE_DIR else None
+        )
+        self.history_checked = TTLCache(
+            max_size=settings.PRICE_CACHE_MAX_SIZE, ttl=settings.HISTORY_TOPUP_INTERVAL
+        )
+        # Last daily bar seen per symbol: changes whenever new bars are ingested
+        self.history_versions: Dict[str, str] = {}
     
     async def close(self):
         """Close the HTTP client"""
         await self.client.aclose()
     
-    async def get_current_price(self, symbol: str) -> Optional[float]:
-        """Get current price for a symbol"""
+    async def get_current_price(self, symbol: str, refresh: bool = False) -> Optional[float]:
+        """Get current price for a symbol
+
+        refresh skips the caches and asks upstream; provider errors then
+        raise instead of falling back to a mock price.
+        """
+        if refresh:
+            return await self.flights.do(("quote", symbol), lambda: self._refresh_current_price(symbol))
+        
         # Check cache first
-        cache_key = f"price_{symbol}"
-        if cache_key in self.cache:
-            cached_data, timestamp = self.cache[cache_key]
-            if datetime.now().timestamp() - timestamp < self.cache_ttl:
-                return cached_data
+        cached_price = self.price_cache.get(symbol)
+        if cached_price is not None:
+            return cached_price
         
+        return await self.flights.do(("price", symbol), lambda: self._load_current_price(symbol))
+    
+    async def _load_current_price(self, symbol: str) -> Optional[float]:
+        """Get a price from the shared cache, or fetch it upstream"""
+        if self.shared_cache is not None:
+            shared = await self.shared_cache.get_prices([symbol])
+            if symbol in shared:
+                self.price_cache.set(symbol, shared[symbol])
+                return shared[symbol]
+        
+        return await self._fetch_current_price(symbol)
+    
+    async def _cache_prices(self, prices: Dict[str, float]):
+        """Store freshly fetched prices locally and in the shared cache"""
+        for symbol, price in prices.items():
+            self.price_cache.set(symbol, price)
+        if self.shared_cache is not None:
+            await self.shared_cache.set_prices(prices)
+    
+    async def _fetch_current_price(self, symbol: str) -> Optional[float]:
+        """Fetch current price from the first available provider"""
         try:
-            # Try Polygon.io first if API key is available
-            if settings.POLYGON_API_KEY:
-                price = await self._get_polygon_price(symbol)
-                if price:
-                    self.cache[cache_key] = (price, datetime.now().timestamp())
-                    return price
-            
-            # Fallback to Alpha Vantage
-            if settings.ALPHA_VANTAGE_API_KEY:
-                price = await self._get_alpha_vantage_price(symbol)
-                if price:
-                    self.cache[cache_key] = (price, datetime.now().timestamp())
-                    return price
+            price = await self._fetch_upstream_price(symbol)
+            if price:
+                return price
             
             # Fallback to mock data for demo purposes
             return await self._get_mock_price(symbol)
@@ -50,46 +113,293 @@ class MarketDataService:
             print(f"Error fetching price for {symbol}: {e}")
             return await self._get_mock_price(symbol)
     
-    async def get_multiple_prices(self, symbols: List[str]) -> Dict[str, float]:
-        """Get current prices for multiple symbols"""
-        tasks = [self.get_current_price(symbol) for symbol in symbols]
-        prices = await asyncio.gather(*tasks, return_exceptions=True)
+    async def _refresh_current_price(self, symbol: str) -> Optional[float]:
+        """Quote a symbol upstream for the price loop, never substituting a mock price
+
+        Provider errors propagate; None means no provider had a price. Mock
+        prices are only used when no provider is configured at all.
+        """
+        if not (settings.POLYGON_API_KEY or settings.ALPHA_VANTAGE_API_KEY):
+            return await self._get_mock_price(symbol)
+        return await self._fetch_upstream_price(symbol)
+    
+    async def _fetch_upstream_price(self, symbol: str) -> Optional[float]:
+        """Price from the first provider that has one, or None; provider errors raise"""
+        # Try Polygon.io first if API key is available
+        if settings.POLYGON_API_KEY:
+            price = await self._get_polygon_price(symbol)
+            if price:
+                await self._cache_prices({symbol: price})
+                return price
+        
+        # Fallback to Alpha Vantage
+        if settings.ALPHA_VANTAGE_API_KEY:
+            price = await self._get_alpha_vantage_price(symbol)
+            if price:
+                await self._cache_prices({symbol: price})
+                return price
         
+        return None
+    
+    def get_cache_stats(self) -> Dict[str, Dict]:
+        """Get hit/miss counters for the service caches"""
+        return {
+            'prices': self.price_cache.stats(),
+            'singleflight': self.flights.stats(),
+            'batches': {
+                'quote_requests': self.quote_requests,
+                'requests': self.batch_requests,
+                'failed': self.failed_batches,
+                'batch_size': self.batch_size,
+            },
+            'shared': self.shared_cache.stats() if self.shared_cache is not None else None,
+        }
+    
+    async def get_multiple_prices(self,
+                                  symbols: List[str],
+                                  raise_on_error: bool = False,
+                                  refresh: bool = False) -> Dict[str, float]:
+        """Get current prices for multiple symbols
+
+        Symbols in a batch chunk that fails (or comes back empty, as on a
+        429) get mock prices rather than one upstream request each, so a
+        throttled provider is not hit harder. refresh skips the local and
+        shared caches so every symbol is quoted upstream, and never returns
+        mock prices for a configured provider: symbols without a quote are
+        left out. With raise_on_error any upstream failure raises
+        PriceFetchError instead, for callers that back off. Concurrent
+        callers share in-flight quotes symbol by symbol.
+        """
         result = {}
-        for symbol, price in zip(symbols, prices):
+        missing = []
+        for symbol in dict.fromkeys(symbols):
+            cached_price = None if refresh else self.price_cache.get(symbol)
+            if cached_price is not None:
+                result[symbol] = cached_price
+            else:
+                missing.append(symbol)
+        
+        if missing and self.shared_cache is not None and not refresh:
+            shared = await self.shared_cache.get_prices(missing)
+            for symbol, price in shared.items():
+                self.price_cache.set(symbol, price)
+            result.update(shared)
+            missing = [symbol for symbol in missing if symbol not in shared]
+        
+        if missing and self._has_batch_provider():
+            # One upstream round trip per chunk instead of per symbol; symbols another
+            # caller is already fetching are joined rather than requested again
+            outcomes = await self.flights.do_many(
+                [("batch", symbol) for symbol in missing], self._fetch_price_batches
+            )
+            failed = []
+            for symbol in missing:
+                outcome = outcomes[("batch", symbol)]
+                if isinstance(outcome, Exception):
+                    failed.append(symbol)
+                elif outcome:
+                    result[symbol] = outcome
+            
+            if failed:
+                if raise_on_error:
+                    raise PriceFetchError(f"{len(failed)} of {len(missing)} symbols failed to fetch")
+                if not refresh:
+                    for symbol in failed:
+                        result[symbol] = await self._get_mock_price(symbol)
+            missing = [symbol for symbol in missing if symbol not in result and symbol not in failed]
+        
+        # Per-symbol path for anything a successful batch didn't cover
+        tasks = [self.get_current_price(symbol, refresh=refresh) for symbol in missing]
+        prices = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        failed = []
+        for symbol, price in zip(missing, prices):
             if isinstance(price, Exception):
                 print(f"Error getting price for {symbol}: {price}")
-                result[symbol] = await self._get_mock_price(symbol)
-            else:
+                if refresh:
+                    failed.append(symbol)
+                else:
+                    result[symbol] = await self._get_mock_price(symbol)
+            elif price is not None or not refresh:
                 result[symbol] = price
         
+        if failed and raise_on_error:
+            raise PriceFetchError(f"{len(failed)} of {len(missing)} symbol quotes failed")
         return result
     
+    def get_quote_provider(self):
+        """Name of the active quote provider and symbols per request (None if unbatched)"""
+        if self.quote_provider is not None:
+            return "custom", self.batch_size
+        if settings.POLYGON_API_KEY:
+            return "polygon", self.batch_size
+        if settings.ALPHA_VANTAGE_API_KEY:
+            return "alpha_vantage", None
+        return "mock", None
+    
+    def _has_batch_provider(self) -> bool:
+        return self.quote_provider is not None or bool(settings.POLYGON_API_KEY)
+    
+    async def _fetch_price_batches(self, keys: List[tuple]) -> Dict[tuple, Any]:
+        """Quote ("batch", symbol) keys in provider-sized chunks, for SingleFlight.do_many
+
+        Symbols of a chunk that fails or comes back empty map to a
+        PriceFetchError; symbols the provider has no price for map to None.
+        """
+        symbols = [symbol for _, symbol in keys]
+        chunks = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        batches = await asyncio.gather(
+            *[self._fetch_price_batch(chunk) for chunk in chunks], return_exceptions=True
+        )
+        
+        outcomes: Dict[tuple, Any] = {}
+        fetched = {}
+        for chunk, batch in zip(chunks, batches):
+            if isinstance(batch, Exception) or not batch:
+                print(f"Error fetching price batch {chunk[0]}..{chunk[-1]}: {batch or 'no prices returned'}")
+                self.failed_batches += 1
+                error = PriceFetchError(f"price batch {chunk[0]}..{chunk[-1]} failed")
+                outcomes.update({("batch", symbol): error for symbol in chunk})
+                continue
+            for symbol in chunk:
+                price = batch.get(symbol)
+                outcomes[("batch", symbol)] = price or None
+                if price:
+                    fetched[symbol] = price
+        await self._cache_prices(fetched)
+        return outcomes
+    
+    async def _fetch_price_batch(self, symbols: List[str]) -> Dict[str, float]:
+        """Fetch one chunk of quotes from the batch provider"""
+        async with self.batch_semaphore:
+            self.batch_requests += 1
+            self.quote_requests += 1
+            if self.quote_provider is not None:
+                return await self.quote_provider(symbols)
+            return await self._get_polygon_prices_batch(symbols)
+    
     async def get_historical_data(self, symbol: str, days: int = 252) -> pd.DataFrame:
         """Get historical price data for risk calculations"""
+        bars = await self.flights.do(
+            ("history", symbol, days), lambda: self._fetch_historical_data(symbol, days)
+        )
+        if not bars.empty:
+            self.history_versions[symbol] = str(pd.Timestamp(bars['date'].iloc[-1]).date())
+        return bars
+    
+    def get_history_versions(self, symbols: List[str]) -> Dict[str, Optional[str]]:
+        """Date of the newest bar seen for each symbol (None if never loaded)"""
+        return {symbol: self.history_versions.get(symbol) for symbol in symbols}
+    
+    async def _fetch_historical_data(self, symbol: str, days: int) -> pd.DataFrame:
+        """Fetch historical data from the bar store or the first available provider"""
+        if not (settings.POLYGON_API_KEY or settings.ALPHA_VANTAGE_API_KEY):
+            return self._generate_mock_historical_data(symbol, days)
+        
         try:
-            if settings.POLYGON_API_KEY:
-                return await self._get_polygon_historical(symbol, days)
-            elif settings.ALPHA_VANTAGE_API_KEY:
-                return await self._get_alpha_vantage_historical(symbol, days)
+            if self.shared_cache is not None:
+                bars = await self.shared_cache.get_history(symbol, days)
+                if bars is not None:
+                    return bars
+            
+            if self.history_store is not None:
+                bars = await self._get_stored_historical(symbol, days)
             else:
-                return self._generate_mock_historical_data(symbol, days)
+                bars = await self._download_historical(symbol, days)
+            
+            if bars is not None and not bars.empty:
+                bars = bars.tail(days).reset_index(drop=True)
+                if self.shared_cache is not None:
+                    await self.shared_cache.set_history(symbol, days, bars)
+                return bars
         except Exception as e:
             print(f"Error fetching historical data for {symbol}: {e}")
-            return self._generate_mock_historical_data(symbol, days)
+        
+        return self._generate_mock_historical_data(symbol, days)
+    
+    async def _get_stored_historical(self, symbol: str, days: int) -> Optional[pd.DataFrame]:
+        """Serve bars from the local store, topping up the missing tail first"""
+        stored = self.history_store.load(symbol)
+        required_start = self._history_start(days)
+        covered_from = self.history_store.covered_from(symbol)
+        
+        bars = None
+        if stored is None or covered_from is None or covered_from > required_start:
+            # The store doesn't reach back far enough for this request: fetch the full window.
+            # Coverage is by date, so symbols with less history than requested aren't refetched
+            bars = await self._download_historical(symbol, days, start_date=required_start)
+            self.history_checked.set(symbol, True)
+            if bars is not None:
+                if not bars.empty:
+                    self.history_store.merge(symbol, bars)
+                self.history_store.set_covered_from(symbol, required_start)
+                return self.history_store.load(symbol, days)
+        elif self.history_checked.get(symbol, count=False) is None:
+            # The tail top-up is consulted at most once per HISTORY_TOPUP_INTERVAL per symbol
+            last_date = stored['date'].iloc[-1]
+            last_close = pd.Timestamp.now().normalize() - pd.offsets.BDay(1)
+            if last_date < last_close:
+                bars = await self._download_historical(
+                    symbol, days, start_date=last_date + timedelta(days=1)
+                )
+            self.history_checked.set(symbol, True)
+            if bars is not None and not bars.empty:
+                self.history_store.merge(symbol, bars)
+                return self.history_store.load(symbol, days)
+        
+        return stored
+    
+    @staticmethod
+    def _history_start(days: int) -> pd.Timestamp:
+        """Calendar start date whose range holds at least `days` trading days"""
+        # Business days cover weekends; the extra margin covers roughly 10 holidays a year
+        return pd.Timestamp.now().normalize() - pd.offsets.BDay(days) - timedelta(days=days // 20 + 7)
+    
+    async def _download_historical(self,
+                                   symbol: str,
+                                   days: int,
+                                   start_date: Optional[datetime] = None) -> Optional[pd.DataFrame]:
+        """Download daily bars from the first available provider"""
+        if settings.POLYGON_API_KEY:
+            return await self._get_polygon_historical(symbol, days, start_date)
+        if settings.ALPHA_VANTAGE_API_KEY:
+            return await self._get_alpha_vantage_historical(symbol, days, start_date)
+        return None
     
     async def _get_polygon_price(self, symbol: str) -> Optional[float]:
         """Fetch price from Polygon.io"""
         url = f"https://api.polygon.io/v2/last/trade/{symbol}"
         params = {"apikey": settings.POLYGON_API_KEY}
         
+        self.quote_requests += 1
         response = await self.client.get(url, params=params)
+        # Rate limits and server errors are provider failures, not a missing quote
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
         if response.status_code == 200:
             data = response.json()
             if data.get("status") == "OK" and "results" in data:
                 return data["results"]["p"]  # price
         return None
     
+    async def _get_polygon_prices_batch(self, symbols: List[str]) -> Dict[str, float]:
+        """Fetch many prices in one round trip from Polygon.io's snapshot endpoint"""
+        url = "https://api.polygon.io/v2/snapshot/locale/us/markets/stocks/tickers"
+        params = {"tickers": ",".join(symbols), "apikey": settings.POLYGON_API_KEY}
+        
+        response = await self.client.get(url, params=params)
+        # Rate limits and other errors fail the whole chunk
+        response.raise_for_status()
+        prices = {}
+        if response.status_code == 200:
+            data = response.json()
+            for ticker in data.get("tickers", []):
+                last_trade = ticker.get("lastTrade") or {}
+                price = last_trade.get("p") or (ticker.get("day") or {}).get("c")
+                if price:
+                    prices[ticker["ticker"]] = price
+        return prices
+    
     async def _get_alpha_vantage_price(self, symbol: str) -> Optional[float]:
         """Fetch price from Alpha Vantage"""
         url = "https://www.alphavantage.co/query"
@@ -99,17 +409,26 @@ class MarketDataService:
             "apikey": settings.ALPHA_VANTAGE_API_KEY
         }
         
+        self.quote_requests += 1
         response = await self.client.get(url, params=params)
         if response.status_code == 200:
             data = response.json()
-            if "Global Quote" in data:
-                return float(data["Global Quote"]["05. price"])
+            # Rate limit notices come back as 200 with a Note/Information message
+            if "Note" in data or "Information" in data:
+                raise PriceFetchError(data.get("Note") or data.get("Information"))
+            quote = data.get("Global Quote") or {}
+            if "05. price" in quote:
+                return float(quote["05. price"])
         return None
     
-    async def _get_polygon_historical(self, symbol: str, days: int) -> pd.DataFrame:
+    async def _get_polygon_historical(self,
+                                      symbol: str,
+                                      days: int,
+                                      start_date: Optional[datetime] = None) -> Optional[pd.DataFrame]:
         """Fetch historical data from Polygon.io"""
         end_date = datetime.now()
-        start_date = end_date - timedelta(days=days + 50)  # Extra buffer for weekends
+        if start_date is None:
+            start_date = self._history_start(days).to_pydatetime()
         
         url = f"https://api.polygon.io/v2/aggs/ticker/{symbol}/range/1/day/{start_date.strftime('%Y-%m-%d')}/{end_date.strftime('%Y-%m-%d')}"
         params = {"apikey": settings.POLYGON_API_KEY}
@@ -119,20 +438,26 @@ class MarketDataService:
             data = response.json()
             if data.get("status") == "OK" and "results" in data:
                 df = pd.DataFrame(data["results"])
-                df['date'] = pd.to_datetime(df['t'], unit='ms')
+                df['date'] = pd.to_datetime(df['t'], unit='ms').dt.normalize()
                 df = df.rename(columns={'c': 'close', 'o': 'open', 'h': 'high', 'l': 'low', 'v': 'volume'})
                 return df[['date', 'close']].tail(days)
         
-        return self._generate_mock_historical_data(symbol, days)
+        return None
     
-    async def _get_alpha_vantage_historical(self, symbol: str, days: int) -> pd.DataFrame:
+    async def _get_alpha_vantage_historical(self,
+                                            symbol: str,
+                                            days: int,
+                                            start_date: Optional[datetime] = None) -> Optional[pd.DataFrame]:
         """Fetch historical data from Alpha Vantage"""
+        # The compact output holds the latest 100 bars, enough for a short top-up
+        compact = start_date is not None and datetime.now() - start_date < timedelta(days=120)
+        
         url = "https://www.alphavantage.co/query"
         params = {
             "function": "TIME_SERIES_DAILY",
             "symbol": symbol,
             "apikey": settings.ALPHA_VANTAGE_API_KEY,
-            "outputsize": "full"
+            "outputsize": "compact" if compact else "full"
         }
         
         response = await self.client.get(url, params=params)
@@ -146,10 +471,12 @@ class MarketDataService:
                         'date': pd.to_datetime(date_str),
                         'close': float(values['4. close'])
                     })
-                df = pd.DataFrame(df_data)
-                return df.sort_values('date').tail(days)
+                df = pd.DataFrame(df_data).sort_values('date')
+                if start_date is not None:
+                    df = df[df['date'] >= pd.Timestamp(start_date).normalize()]
+                return df.tail(days)
         
-        return self._generate_mock_historical_data(symbol, days)
+        return None
     
     async def _get_mock_price(self, symbol: str) -> float:
         """Generate mock price data for demo purposes"""
@@ -162,32 +489,16 @@ class MarketDataService:
         }
         
         base_price = base_prices.get(symbol, 100.0)
-        # Add some random variation (±5%)
-        import random
-        random.seed(hash(symbol) + int(datetime.now().timestamp() / 300))  # 5-minute intervals
-        variation = random.uniform(-0.05, 0.05)
+        # Add some random variation (±5%), stable within 5-minute intervals and across workers
+        rng = symbol_rng(symbol, "price", int(datetime.now().timestamp() / 300))
+        variation = rng.uniform(-0.05, 0.05)
         return round(base_price * (1 + variation), 2)
     
     def _generate_mock_historical_data(self, symbol: str, days: int) -> pd.DataFrame:
         """Generate mock historical data for demo purposes"""
-        import random
-        
-        # Set seed for consistency
-        random.seed(hash(symbol))
-        np.random.seed(hash(symbol) % 2**32)
-        
-        base_price = 100.0
-        dates = pd.date_range(end=datetime.now(), periods=days, freq='D')
-        
-        # Generate realistic price movement using random walk
-        returns = np.random.normal(0.001, 0.02, days)  # Daily returns with slight upward drift
-        prices = [base_price]
-        
-        for i in range(1, days):
-            new_price = prices[-1] * (1 + returns[i])
-            prices.append(max(new_price, 1.0))  # Ensure price doesn't go below $1
-        
+        # Random walk with slight upward drift, seeded per symbol
+        prices = generate_mock_prices([symbol], days)
         return pd.DataFrame({
-            'date': dates,
-            'close': prices
+            'date': prices.index,
+            'close': prices[symbol].to_numpy()
         })
@@ -0,0 +1,75 @@
+import hashlib
+from datetime import datetime
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+def stable_seed(*parts) -> int:
+    """64-bit seed that is identical across processes (unlike hash())"""
+    key = "|".join(str(part) for part in parts).encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def symbol_rng(*parts) -> np.random.Generator:
+    """Independent random generator for a symbol (plus any extra key parts)"""
+    return np.random.default_rng(stable_seed(*parts))
+
+
+def generate_mock_returns(symbols: List[str],
+                          days: int,
+                          drift: float = 0.001,
+                          volatility: float = 0.02,
+                          correlation: Union[float, np.ndarray] = 0.0) -> np.ndarray:
+    """Daily returns, shape (days, len(symbols))
+
+    Each symbol draws from its own generator, so uncorrelated series only
+    depend on the symbol. correlation is either one pairwise correlation
+    for every pair (a one-factor model, so 0 <= correlation < 1) or a full
+    correlation matrix, which also allows negative correlations.
+    """
+    # Fill one contiguous row per symbol, then view as (days, symbols)
+    shocks = np.empty((len(symbols), days))
+    for row, symbol in enumerate(symbols):
+        symbol_rng(symbol, "returns").standard_normal(days, out=shocks[row])
+    shocks = shocks.T
+
+    if np.ndim(correlation) == 0:
+        rho = float(correlation)
+        if not 0 <= rho < 1:
+            raise ValueError(
+                "Scalar correlation must be in [0, 1); pass a correlation matrix for negative correlations"
+            )
+        if rho:
+            factor = symbol_rng("market", "returns").standard_normal((days, 1))
+            shocks *= np.sqrt(1 - rho)
+            shocks += np.sqrt(rho) * factor
+    else:
+        cholesky = np.linalg.cholesky(np.asarray(correlation, dtype=np.float64))
+        shocks = shocks @ cholesky.T
+
+    shocks *= volatility
+    shocks += drift
+    return shocks
+
+
+def generate_mock_prices(symbols: List[str],
+                         days: int,
+                         base_price: float = 100.0,
+                         end: Optional[datetime] = None,
+                         **kwargs) -> pd.DataFrame:
+    """Wide panel of random-walk closes indexed by date, one column per symbol
+
+    Prices start at base_price and compound the generated returns; they are
+    floored at $1.
+    """
+    returns = generate_mock_returns(symbols, days, **kwargs)
+    returns[0] = 0.0
+    returns += 1.0
+    prices = np.cumprod(returns, axis=0, out=returns)
+    prices *= base_price
+    np.maximum(prices, 1.0, out=prices)
+
+    dates = pd.date_range(end=end or datetime.now(), periods=days, freq='D')
+    return pd.DataFrame(prices, index=dates, columns=list(symbols))
@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List
+
+TickHandler = Callable[[Dict[str, float]], Awaitable[None]]
+
+
+class PriceBroker:
+    """Fan-out of price ticks and the subscription registry across API nodes
+
+    Every node registers its subscriber counts, asks the broker which
+    symbols it should poll upstream, publishes the ticks it fetched and
+    consumes every published tick to broadcast to its own clients.
+    """
+
+    def __init__(self):
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ticks_published = 0
+        self.ticks_received = 0
+
+    async def register_node(self, subscriber_counts: Dict[str, int], connections: int):
+        """Record this node's subscriptions and connection count"""
+        raise NotImplementedError
+
+    async def get_poll_assignment(self,
+                                  subscriber_counts: Dict[str, int],
+                                  always_poll: List[str]) -> Dict[str, int]:
+        """Symbols this node should poll, with cluster-wide subscriber counts"""
+        raise NotImplementedError
+
+    async def live_nodes(self) -> int:
+        """Number of live nodes sharing the upstream provider budgets"""
+        return 1
+
+    async def publish_prices(self, prices: Dict[str, float]):
+        raise NotImplementedError
+
+    async def listen(self, handler: TickHandler):
+        """Consume published ticks forever"""
+        raise NotImplementedError
+
+    async def get_cluster_stats(self) -> Dict:
+        """Per-node connection counts and symbol sets"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryPriceBroker(PriceBroker):
+    """Single-node broker: this process polls and broadcasts everything itself"""
+
+    def __init__(self):
+        super().__init__()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._subscriber_counts: Dict[str, int] = {}
+        self._connections = 0
+
+    async def register_node(self, subscriber_counts: Dict[str, int], connections: int):
+        self._subscriber_counts = dict(subscriber_counts)
+        self._connections = connections
+
+    async def get_poll_assignment(self,
+                                  subscriber_counts: Dict[str, int],
+                                  always_poll: List[str]) -> Dict[str, int]:
+        assignment = dict(subscriber_counts)
+        if assignment:
+            for symbol in always_poll:
+                assignment.setdefault(symbol, 0)
+        return assignment
+
+    async def publish_prices(self, prices: Dict[str, float]):
+        self._queue.put_nowait(prices)
+        self.ticks_published += 1
+
+    async def listen(self, handler: TickHandler):
+        while True:
+            prices = await self._queue.get()
+            self.ticks_received += 1
+            try:
+                await handler(prices)
+            except Exception as e:
+                print(f"Error handling price tick: {e}")
+
+    async def get_cluster_stats(self) -> Dict:
+        return {
+            'broker': 'memory',
+            'node_id': self.node_id,
+            'nodes': {
+                self.node_id: {
+                    'connections': self._connections,
+                    'symbols': sorted(self._subscriber_counts),
+                    'polled_symbols': len(self._subscriber_counts),
+                }
+            },
+            'ticks_published': self.ticks_published,
+            'ticks_received': self.ticks_received,
+        }
+
+
+class RedisPriceBroker(PriceBroker):
+    """Multi-node broker backed by Redis hashes and pub/sub
+
+    Each node keeps its subscriber counts in a hash with a TTL. Every
+    symbol is polled by exactly one node among those whose clients need it,
+    chosen by rendezvous hashing, so nodes only poll symbols they serve and
+    no symbol is fetched twice. Ticks go out on one pub/sub channel that
+    every node consumes.
+    """
+
+    def __init__(self,
+                 client,
+                 prefix: str = "mds",
+                 registration_ttl: float = 30.0,
+                 assignment_refresh: float = 1.0):
+        super().__init__()
+        self.client = client
+        self.channel = f"{prefix}:prices"
+        self.subscriptions_prefix = f"{prefix}:subscriptions:"
+        self.nodes_prefix = f"{prefix}:nodes:"
+        self.registration_ttl = registration_ttl
+        self.assignment_refresh = assignment_refresh
+        self._registered_at = 0.0
+        self._registered_state = None
+        self._node_symbols: Dict[str, Dict[str, int]] = {}
+        self._node_symbols_at = 0.0
+        self.polled_symbols = 0
+
+    async def register_node(self, subscriber_counts: Dict[str, int], connections: int):
+        now = time.monotonic()
+        state = (dict(subscriber_counts), connections)
+        if state == self._registered_state and now - self._registered_at < self.registration_ttl / 3:
+            return
+
+        ttl = int(self.registration_ttl)
+        subscriptions_key = self.subscriptions_prefix + self.node_id
+        node_key = self.nodes_prefix + self.node_id
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(subscriptions_key)
+            if subscriber_counts:
+                pipe.hset(subscriptions_key, mapping=subscriber_counts)
+                pipe.expire(subscriptions_key, ttl)
+            pipe.hset(node_key, mapping={
+                'connections': connections,
+                'symbols': len(subscriber_counts),
+                'polled_symbols': self.polled_symbols,
+                'heartbeat': time.time(),
+            })
+            pipe.expire(node_key, ttl)
+            await pipe.execute()
+        self._registered_state = state
+        self._registered_at = now
+
+    async def _get_node_symbols(self) -> Dict[str, Dict[str, int]]:
+        """Subscriber counts per live node, refreshed at most every assignment_refresh"""
+        now = time.monotonic()
+        if now - self._node_symbols_at < self.assignment_refresh:
+            return self._node_symbols
+
+        node_symbols: Dict[str, Dict[str, int]] = {}
+        async for key in self.client.scan_iter(match=self.nodes_prefix + "*"):
+            node_symbols[key[len(self.nodes_prefix):]] = {}
+        async for key in self.client.scan_iter(match=self.subscriptions_prefix + "*"):
+            counts = await self.client.hgetall(key)
+            node_symbols[key[len(self.subscriptions_prefix):]] = {
+                symbol: int(count) for symbol, count in counts.items()
+            }
+        self._node_symbols = node_symbols
+        self._node_symbols_at = now
+        return node_symbols
+
+    @staticmethod
+    def _owner(symbol: str, candidates) -> str:
+        """Rendezvous hashing: stable owner that moves only when candidates change"""
+        return max(
+            candidates,
+            key=lambda node: hashlib.blake2b(f"{node}|{symbol}".encode(), digest_size=8).digest()
+        )
+
+    async def get_poll_assignment(self,
+                                  subscriber_counts: Dict[str, int],
+                                  always_poll: List[str]) -> Dict[str, int]:
+        node_symbols = await self._get_node_symbols()
+        # Our own registration may not be visible yet
+        node_symbols = {**node_symbols, self.node_id: subscriber_counts}
+
+        totals: Dict[str, int] = {}
+        for counts in node_symbols.values():
+            for symbol, count in counts.items():
+                totals[symbol] = totals.get(symbol, 0) + count
+
+        assignment = {}
+        for symbol in subscriber_counts:
+            candidates = [node for node, counts in node_symbols.items() if symbol in counts]
+            if self._owner(symbol, candidates) == self.node_id:
+                assignment[symbol] = totals[symbol]
+
+        # Cluster-wide symbols (e.g. the benchmark) go to one of all live nodes
+        if totals:
+            for symbol in always_poll:
+                if symbol not in totals and self._owner(symbol, node_symbols) == self.node_id:
+                    assignment[symbol] = 0
+
+        self.polled_symbols = len(assignment)
+        return assignment
+
+    async def live_nodes(self) -> int:
+        node_symbols = await self._get_node_symbols()
+        return len(node_symbols) + (self.node_id not in node_symbols)
+
+    async def publish_prices(self, prices: Dict[str, float]):
+        await self.client.publish(self.channel, json.dumps(prices))
+        self.ticks_published += 1
+
+    async def listen(self, handler: TickHandler):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    self.ticks_received += 1
+                    try:
+                        await handler(json.loads(message["data"]))
+                    except Exception as e:
+                        print(f"Error handling price tick: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in Redis price subscription, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def get_cluster_stats(self) -> Dict:
+        nodes = {}
+        async for key in self.client.scan_iter(match=self.nodes_prefix + "*"):
+            node_id = key[len(self.nodes_prefix):]
+            info = await self.client.hgetall(key)
+            symbols = await self.client.hkeys(self.subscriptions_prefix + node_id)
+            nodes[node_id] = {
+                'connections': int(info.get('connections', 0)),
+                'symbols': sorted(symbols),
+                'polled_symbols': int(info.get('polled_symbols', 0)),
+                'heartbeat': float(info.get('heartbeat', 0)),
+            }
+        return {
+            'broker': 'redis',
+            'node_id': self.node_id,
+            'nodes': nodes,
+            'ticks_published': self.ticks_published,
+            'ticks_received': self.ticks_received,
+        }
+
+    async def close(self):
+        """Drop this node's registration so its symbols are reassigned"""
+        try:
+            await self.client.delete(
+                self.subscriptions_prefix + self.node_id, self.nodes_prefix + self.node_id
+            )
+        except Exception as e:
+            print(f"Error releasing Redis broker state: {e}")
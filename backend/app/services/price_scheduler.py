@@ -0,0 +1,275 @@
+import math
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def is_market_hours(now: Optional[datetime] = None) -> bool:
+    """Rough US market hours check (9:00-16:00 local, Monday-Friday)"""
+    now = now or datetime.now()
+    return now.weekday() < 5 and 9 <= now.hour < 16
+
+
+class ProviderBudget:
+    """Token bucket rate budget plus jittered exponential backoff for one provider
+
+    cluster_requests_per_minute is the provider's limit for the whole
+    deployment; each node's bucket refills at its share of it.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float], backoff_base: float, backoff_cap: float):
+        self.cluster_requests_per_minute = requests_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.capacity = requests_per_minute or 0.0
+        self.tokens = self.capacity
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failures = 0
+        self.backoff_until = 0.0
+        self._refilled_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.requests_per_minute
+
+    def refill(self, now: float):
+        if not self.unlimited:
+            elapsed = max(now - self._refilled_at, 0.0)
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.requests_per_minute / 60)
+        self._refilled_at = max(now, self._refilled_at)
+
+    def available(self, now: float) -> float:
+        """Requests that can be made right now"""
+        if now < self.backoff_until:
+            return 0
+        self.refill(now)
+        return math.inf if self.unlimited else math.floor(self.tokens)
+
+    def set_share(self, nodes: int, now: float):
+        """Refill at 1/nodes of the cluster-wide limit"""
+        if self.unlimited:
+            return
+        self.refill(now)
+        self.requests_per_minute = self.cluster_requests_per_minute / max(nodes, 1)
+        self.capacity = self.requests_per_minute
+        self.tokens = min(self.tokens, self.capacity)
+
+    def spend(self, requests: int):
+        if not self.unlimited:
+            self.tokens -= requests
+
+    def record_success(self):
+        self.failures = 0
+        self.backoff_until = 0.0
+
+    def record_failure(self, now: float) -> float:
+        """Register an error and return the jittered backoff delay in seconds"""
+        self.failures += 1
+        ceiling = min(self.backoff_cap, self.backoff_base * 2 ** (self.failures - 1))
+        delay = random.uniform(ceiling / 2, ceiling)
+        self.backoff_until = now + delay
+        return delay
+
+
+class PriceScheduler:
+    """Decides which subscribed symbols to refresh on each price loop cycle
+
+    Each symbol gets its own refresh interval: the base interval shrinks
+    with more subscribers and with higher recent volatility, and stretches
+    outside market hours. Due symbols are refreshed most-overdue first
+    within the active provider's request budget, which is split evenly
+    across the live API nodes so the cluster stays under the provider limit.
+    """
+
+    def __init__(self,
+                 base_interval: float = 5.0,
+                 min_interval: float = 1.0,
+                 max_interval: float = 60.0,
+                 off_hours_multiplier: float = 6.0,
+                 reference_move_bps: float = 10.0,
+                 rate_limits: Optional[Dict[str, Optional[float]]] = None,
+                 backoff_base: float = 1.0,
+                 backoff_cap: float = 60.0):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.off_hours_multiplier = off_hours_multiplier
+        self.reference_move = reference_move_bps / 10000
+        self.rate_limits = rate_limits or {}
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.budgets: Dict[str, ProviderBudget] = {}
+        self.nodes = 1
+        self._requests_seen = 0
+        self.last_refresh: Dict[str, float] = {}
+        self.last_price: Dict[str, float] = {}
+        # EWMA of absolute relative price moves between refreshes
+        self.recent_move: Dict[str, float] = {}
+
+        self.cycles = 0
+        self.symbols_refreshed = 0
+        self.last_cycle_seconds = 0.0
+        self.max_cycle_seconds = 0.0
+        self.total_cycle_seconds = 0.0
+
+    def budget(self, provider: str) -> ProviderBudget:
+        if provider not in self.budgets:
+            budget = ProviderBudget(self.rate_limits.get(provider), self.backoff_base, self.backoff_cap)
+            budget.set_share(self.nodes, time.monotonic())
+            self.budgets[provider] = budget
+        return self.budgets[provider]
+
+    def set_node_count(self, nodes: int):
+        """Split every provider budget across this many live nodes"""
+        nodes = max(nodes, 1)
+        if nodes == self.nodes:
+            return
+        self.nodes = nodes
+        now = time.monotonic()
+        for budget in self.budgets.values():
+            budget.set_share(nodes, now)
+
+    def interval_for(self, symbol: str, subscribers: int, market_open: bool) -> float:
+        """Refresh interval in seconds for one symbol"""
+        # More subscribers -> faster refresh, logarithmically
+        interval = self.base_interval / (1 + math.log2(max(subscribers, 1)))
+
+        # Volatile names refresh faster, quiet ones slower
+        move = self.recent_move.get(symbol)
+        if move is not None:
+            volatility_factor = min(max(move / self.reference_move, 0.5), 4.0)
+            interval /= volatility_factor
+
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if not market_open:
+            interval *= self.off_hours_multiplier
+        return interval
+
+    def due_symbols(self,
+                    subscriber_counts: Dict[str, int],
+                    provider: str,
+                    batch_size: Optional[int] = None) -> List[str]:
+        """Symbols to refresh now, most overdue first, within the provider budget
+
+        batch_size is the number of symbols one upstream request covers, or
+        None when every symbol costs one request. The budget is only checked
+        here; record_requests charges it for what was actually sent.
+        """
+        now = time.monotonic()
+        market_open = is_market_hours()
+
+        overdue = []
+        for symbol, subscribers in subscriber_counts.items():
+            last_refresh = self.last_refresh.get(symbol)
+            if last_refresh is None:
+                overdue.append((math.inf, symbol))
+                continue
+            lateness = now - last_refresh - self.interval_for(symbol, subscribers, market_open)
+            if lateness >= 0:
+                overdue.append((lateness, symbol))
+
+        if not overdue:
+            return []
+
+        budget = self.budget(provider)
+        requests = budget.available(now)
+        if requests <= 0:
+            return []
+
+        overdue.sort(reverse=True)
+        limit = len(overdue) if math.isinf(requests) else int(requests) * (batch_size or 1)
+        return [symbol for _, symbol in overdue[:limit]]
+
+    def record_requests(self, provider: str, total_requests: int):
+        """Charge the provider budget for upstream requests sent since the last call
+
+        total_requests is a running count of quote requests actually sent
+        (by the price loop or by API traffic), so cache hits cost nothing.
+        """
+        sent = total_requests - self._requests_seen
+        self._requests_seen = total_requests
+        if sent > 0:
+            self.budget(provider).spend(sent)
+
+    def record_refresh(self,
+                       provider: str,
+                       prices: Dict[str, float],
+                       cycle_seconds: float,
+                       requested: Optional[List[str]] = None):
+        """Record a successful refresh and fold the new prices into the volatility estimate
+
+        requested symbols the provider had no quote for count as refreshed
+        too, so they wait a full interval before being asked for again.
+        """
+        now = time.monotonic()
+        for symbol in requested or ():
+            if symbol not in prices:
+                self.last_refresh[symbol] = now
+        for symbol, price in prices.items():
+            last_price = self.last_price.get(symbol)
+            if price and last_price:
+                move = abs(price / last_price - 1)
+                previous = self.recent_move.get(symbol)
+                self.recent_move[symbol] = move if previous is None else 0.8 * previous + 0.2 * move
+            if price:
+                self.last_price[symbol] = price
+            self.last_refresh[symbol] = now
+
+        self.budget(provider).record_success()
+        self.cycles += 1
+        self.symbols_refreshed += len(prices)
+        self.last_cycle_seconds = cycle_seconds
+        self.total_cycle_seconds += cycle_seconds
+        self.max_cycle_seconds = max(self.max_cycle_seconds, cycle_seconds)
+
+    def record_failure(self, provider: str) -> float:
+        """Record a failed cycle; returns how long to back off"""
+        return self.budget(provider).record_failure(time.monotonic())
+
+    def next_wakeup(self, subscriber_counts: Dict[str, int], provider: str) -> float:
+        """Seconds until the next symbol becomes due (bounded to keep the loop responsive)"""
+        now = time.monotonic()
+        market_open = is_market_hours()
+        wait = self.base_interval
+        for symbol, subscribers in subscriber_counts.items():
+            last_refresh = self.last_refresh.get(symbol)
+            if last_refresh is None:
+                wait = 0.0
+                break
+            wait = min(wait, last_refresh + self.interval_for(symbol, subscribers, market_open) - now)
+
+        budget = self.budget(provider)
+        wait = max(wait, budget.backoff_until - now)
+        return max(wait, self.min_interval / 4)
+
+    def forget(self, active_symbols):
+        """Drop state for symbols nobody is subscribed to any more"""
+        for symbol in list(self.last_refresh):
+            if symbol not in active_symbols:
+                self.last_refresh.pop(symbol, None)
+                self.last_price.pop(symbol, None)
+                self.recent_move.pop(symbol, None)
+
+    def stats(self) -> Dict:
+        """Cycle timing and per-provider budget state"""
+        return {
+            'cycles': self.cycles,
+            'symbols_refreshed': self.symbols_refreshed,
+            'tracked_symbols': len(self.last_refresh),
+            'last_cycle_ms': 1000 * self.last_cycle_seconds,
+            'avg_cycle_ms': 1000 * self.total_cycle_seconds / self.cycles if self.cycles else 0.0,
+            'max_cycle_ms': 1000 * self.max_cycle_seconds,
+            'nodes': self.nodes,
+            'providers': {
+                name: {
+                    'tokens': None if budget.unlimited else budget.tokens,
+                    'requests_per_minute': budget.requests_per_minute,
+                    'cluster_requests_per_minute': budget.cluster_requests_per_minute,
+                    'failures': budget.failures,
+                    'backoff_remaining': max(budget.backoff_until - time.monotonic(), 0.0),
+                }
+                for name, budget in self.budgets.items()
+            },
+        }
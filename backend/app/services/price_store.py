@@ -0,0 +1,131 @@
+import os
+import re
+import tempfile
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+BAR_DTYPE = np.dtype([("date", "datetime64[D]"), ("close", np.float64)])
+
+
+class HistoricalPriceStore:
+    """On-disk daily bar store, one .npy file of (date, close) records per symbol
+
+    Both columns live in one structured array, so a single atomic replace
+    publishes them together and readers in other workers never see dates
+    from one write paired with closes from another. Reads memory-map the
+    file and pick out the column fields they need.
+
+    Next to the bars, a small .covered file records the earliest date a
+    full download started from. A short store can then be told apart from
+    a symbol that simply has less history (e.g. a recent listing).
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _path(self, symbol: str) -> str:
+        safe_symbol = re.sub(r"[^A-Za-z0-9._-]", "_", symbol.upper())
+        return os.path.join(self.root_dir, f"{safe_symbol}.bars.npy")
+
+    def _covered_path(self, symbol: str) -> str:
+        return self._path(symbol)[:-len(".bars.npy")] + ".covered"
+
+    def covered_from(self, symbol: str) -> Optional[pd.Timestamp]:
+        """Earliest date the stored history was downloaded from, or None if unknown"""
+        try:
+            with open(self._covered_path(symbol)) as f:
+                return pd.Timestamp(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def set_covered_from(self, symbol: str, start: pd.Timestamp):
+        """Record that bars from start onwards have been downloaded (keeps the earliest)"""
+        start = pd.Timestamp(start).normalize()
+        covered = self.covered_from(symbol)
+        if covered is not None and covered <= start:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, suffix=".covered.tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(start.date().isoformat())
+            os.replace(tmp_path, self._covered_path(symbol))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def has(self, symbol: str) -> bool:
+        return os.path.exists(self._path(symbol))
+
+    def load_arrays(self, symbol: str):
+        """Return memory-mapped (dates, close) arrays, or None if not stored"""
+        if not self.has(symbol):
+            return None
+        try:
+            bars = np.load(self._path(symbol), mmap_mode="r")
+            if bars.dtype != BAR_DTYPE:
+                raise ValueError(f"unexpected bar dtype {bars.dtype}")
+            return bars["date"], bars["close"]
+        except (OSError, ValueError) as e:
+            print(f"Error reading stored history for {symbol}: {e}")
+            return None
+
+    def load(self, symbol: str, days: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """Return stored bars as a date/close DataFrame (last `days` rows)"""
+        arrays = self.load_arrays(symbol)
+        if arrays is None:
+            return None
+        dates, close = arrays
+        if days is not None:
+            dates, close = dates[-days:], close[-days:]
+        return pd.DataFrame({
+            'date': dates.astype("datetime64[ns]"),
+            'close': np.array(close, dtype=np.float64)
+        })
+
+    def last_date(self, symbol: str) -> Optional[pd.Timestamp]:
+        arrays = self.load_arrays(symbol)
+        if arrays is None or len(arrays[0]) == 0:
+            return None
+        return pd.Timestamp(arrays[0][-1])
+
+    def merge(self, symbol: str, bars: pd.DataFrame) -> int:
+        """Merge new bars into the store; newer values win on the same date
+
+        Returns the number of bars stored for the symbol afterwards.
+        """
+        new_dates = pd.to_datetime(bars['date']).to_numpy().astype("datetime64[D]")
+        new_close = bars['close'].to_numpy(dtype=np.float64)
+
+        arrays = self.load_arrays(symbol)
+        if arrays is not None:
+            dates = np.concatenate([np.asarray(arrays[0]), new_dates])
+            close = np.concatenate([np.asarray(arrays[1]), new_close])
+        else:
+            dates, close = new_dates, new_close
+
+        # Keep the last occurrence of each date, sorted ascending
+        order = np.argsort(dates, kind="stable")[::-1]
+        _, first = np.unique(dates[order], return_index=True)
+        keep = order[first]
+        records = np.empty(len(keep), dtype=BAR_DTYPE)
+        records["date"] = dates[keep]
+        records["close"] = close[keep]
+
+        self._atomic_save(self._path(symbol), records)
+        return len(records)
+
+    def _atomic_save(self, path: str, array: np.ndarray):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, suffix=".npy.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,97 @@
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class RedisMarketCache:
+    """Price and history cache shared by every worker through Redis
+
+    Errors are logged and treated as cache misses so a Redis outage only
+    costs extra upstream calls.
+    """
+
+    def __init__(self, client, price_ttl: int = 60, history_ttl: int = 3600, prefix: str = "mds"):
+        self.client = client
+        self.price_ttl = price_ttl
+        self.history_ttl = history_ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _price_key(self, symbol: str) -> str:
+        return f"{self.prefix}:price:{symbol}"
+
+    def _history_key(self, symbol: str, days: int) -> str:
+        return f"{self.prefix}:history:{symbol}:{days}"
+
+    async def get_prices(self, symbols: List[str]) -> Dict[str, float]:
+        """Cached prices for whichever of the symbols are present"""
+        if not symbols:
+            return {}
+        try:
+            values = await self.client.mget([self._price_key(symbol) for symbol in symbols])
+        except Exception as e:
+            self.errors += 1
+            print(f"Error reading prices from Redis: {e}")
+            return {}
+
+        prices = {symbol: float(value) for symbol, value in zip(symbols, values) if value is not None}
+        self.hits += len(prices)
+        self.misses += len(symbols) - len(prices)
+        return prices
+
+    async def set_prices(self, prices: Dict[str, float]):
+        if not prices:
+            return
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for symbol, price in prices.items():
+                    if price is not None:
+                        pipe.set(self._price_key(symbol), repr(float(price)), ex=self.price_ttl)
+                await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing prices to Redis: {e}")
+
+    async def get_history(self, symbol: str, days: int) -> Optional[pd.DataFrame]:
+        try:
+            payload = await self.client.get(self._history_key(symbol, days))
+        except Exception as e:
+            self.errors += 1
+            print(f"Error reading history from Redis: {e}")
+            return None
+
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        data = json.loads(payload)
+        return pd.DataFrame({
+            'date': pd.to_datetime(np.asarray(data['dates'], dtype=np.int64), unit='ms'),
+            'close': np.asarray(data['close'], dtype=np.float64)
+        })
+
+    async def set_history(self, symbol: str, days: int, bars: pd.DataFrame):
+        dates = pd.to_datetime(bars['date']).to_numpy().astype("datetime64[ms]").astype(np.int64)
+        payload = json.dumps({
+            'dates': dates.tolist(),
+            'close': bars['close'].to_numpy(dtype=np.float64).tolist()
+        })
+        try:
+            await self.client.set(self._history_key(symbol, days), payload, ex=self.history_ttl)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing history to Redis: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
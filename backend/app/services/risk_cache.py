@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+from .singleflight import SingleFlight
+
+
+class RiskResultCache:
+    """Portfolio risk results keyed by a fingerprint of everything they depend on
+
+    Each entry is stored under a key (portfolio id plus calculation
+    parameters) together with a fingerprint of the holdings and the price
+    data version. A lookup whose fingerprint differs is a miss, so changed
+    holdings or newly ingested bars never serve old results. Results are
+    fresh for ttl seconds; after that, with stale-while-revalidate on, they
+    are served for up to stale_ttl more seconds while one background task
+    recomputes them.
+    """
+
+    def __init__(self,
+                 ttl: float = 300.0,
+                 stale_ttl: float = 3600.0,
+                 stale_while_revalidate: bool = True,
+                 max_size: int = 2000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._refreshing: Set[Hashable] = set()
+        # Strong references so pending background refreshes aren't garbage collected
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        # Concurrent misses for the same key and fingerprint share one computation
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.refresh_errors = 0
+
+    @staticmethod
+    def fingerprint(*parts) -> str:
+        """Stable digest of JSON-serialisable inputs"""
+        payload = json.dumps(parts, sort_keys=True, default=str).encode()
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    async def get_or_compute(self,
+                             key: Hashable,
+                             fingerprint: Callable[[], str],
+                             compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached result for key, recomputing when missing, changed or expired
+
+        fingerprint is called before the lookup and again after computing,
+        so versions learned while computing are part of the stored entry.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, entry_fingerprint, computed_at = entry
+            age = time.monotonic() - computed_at
+            if entry_fingerprint == fingerprint():
+                if age < self.ttl:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return value
+                if self.stale_while_revalidate and age < self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._entries.move_to_end(key)
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        task = asyncio.create_task(self._refresh(key, fingerprint, compute))
+                        self._refresh_tasks.add(task)
+                        task.add_done_callback(self._refresh_tasks.discard)
+                    return value
+
+        self.misses += 1
+        return await self.flights.do((key, fingerprint()), lambda: self._compute(key, fingerprint, compute))
+
+    async def _compute(self, key: Hashable, fingerprint, compute):
+        value = await compute()
+        self._store(key, fingerprint(), value)
+        return value
+
+    async def _refresh(self, key: Hashable, fingerprint, compute):
+        try:
+            value = await compute()
+            self._store(key, fingerprint(), value)
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"Error revalidating cached risk result {key}: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def _store(self, key: Hashable, fingerprint: str, value: Any):
+        self._entries[key] = (value, fingerprint, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_portfolio(self, portfolio_id: int):
+        """Drop every cached result for a portfolio (keys start with its id)"""
+        for key in [key for key in self._entries if key[0] == portfolio_id]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+            'stale_while_revalidate': self.stale_while_revalidate,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshing': len(self._refreshing),
+            'invalidations': self.invalidations,
+            'refresh_errors': self.refresh_errors,
+            'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from scipy.stats import norm
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime, timedelta
 from ..core.config import settings
@@ -20,8 +21,7 @@ class RiskCalculator:
                                   weights: Dict[str, float]) -> pd.Series:
         """Calculate portfolio returns given asset prices and weights"""
         # Ensure all price series have the same dates
-        price_df = pd.DataFrame(asset_prices)
-        price_df = price_df.dropna()
+        price_df = self.align_prices(asset_prices)
         
         # Calculate returns for each asset
         returns_df = price_df.pct_change().dropna()
@@ -98,7 +98,7 @@ class RiskCalculator:
             # Parametric VaR (assumes normal distribution)
             mean = returns.mean()
             std = returns.std()
-            z_score = -1.65 if confidence_level == 0.95 else -2.33  # 95% or 99%
+            z_score = norm.ppf(1 - confidence_level)
             return mean + z_score * std
         
         else:
@@ -176,52 +176,289 @@ class RiskCalculator:
         
         return active_returns.mean() / tracking_error
     
-    def calculate_portfolio_metrics(self,
-                                  asset_prices: Dict[str, pd.Series],
-                                  weights: Dict[str, float],
-                                  market_prices: Optional[pd.Series] = None) -> Dict[str, float]:
-        """Calculate comprehensive portfolio risk metrics"""
+    def close_series(self, historical_df: pd.DataFrame) -> pd.Series:
+        """Closes indexed by calendar date, so symbols align on dates rather than row positions"""
+        return pd.Series(
+            historical_df['close'].to_numpy(),
+            index=pd.DatetimeIndex(historical_df['date']).normalize()
+        )
+    
+    def align_prices(self, asset_prices: Dict[str, pd.Series]) -> pd.DataFrame:
+        """Price panel (dates x symbols) restricted to dates every symbol has"""
+        return pd.DataFrame(asset_prices).dropna()
+    
+    def build_returns_matrix(self,
+                             asset_prices: Dict[str, pd.Series]) -> Tuple[List[str], pd.Index, np.ndarray]:
+        """Align asset prices once and return (symbols, index, returns matrix)
+
+        The returns matrix is a C-contiguous float64 array of shape
+        (observations, assets), on the same dates as calculate_portfolio_returns.
+        """
+        price_df = self.align_prices(asset_prices)
+        prices = np.ascontiguousarray(price_df.to_numpy(dtype=np.float64))
         
-        # Calculate portfolio returns
-        portfolio_returns = self.calculate_portfolio_returns(asset_prices, weights)
+        if len(prices) < 2:
+            return list(price_df.columns), price_df.index[:0], np.empty((0, prices.shape[1]))
         
-        if len(portfolio_returns) == 0:
+        returns = prices[1:] / prices[:-1] - 1.0
+        return list(price_df.columns), price_df.index[1:], returns
+    
+    def weights_vector(self, symbols: List[str], weights: Dict[str, float]) -> np.ndarray:
+        """Order a weights dict to match the columns of a returns matrix"""
+        return np.array([weights.get(symbol, 0.0) for symbol in symbols], dtype=np.float64)
+    
+    def align_market_returns(self, market_prices: pd.Series, index: pd.Index) -> np.ndarray:
+        """Market returns on the given index, NaN where the benchmark has no data"""
+        market_returns = self.calculate_returns(market_prices)
+        return market_returns.reindex(index).to_numpy(dtype=np.float64)
+    
+    def calculate_metrics_from_returns(self,
+                                       portfolio_returns: np.ndarray,
+                                       market_returns: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """Derive every portfolio metric from one returns vector in a single pass"""
+        n = len(portfolio_returns)
+        if n == 0:
             return self._empty_metrics()
         
-        # Basic metrics
+        daily_rf = self.risk_free_rate / 252
+        mean = portfolio_returns.mean()
+        std = portfolio_returns.std(ddof=1) if n > 1 else np.nan
+        
+        excess = portfolio_returns - daily_rf
+        mean_excess = mean - daily_rf
+        downside = excess[excess < 0]
+        
+        var_95 = np.percentile(portfolio_returns, 5)
+        tail = portfolio_returns[portfolio_returns <= var_95]
+        
+        wealth = np.cumprod(1.0 + portfolio_returns)
+        
         metrics = {
-            'total_return': (portfolio_returns + 1).prod() - 1,
-            'annualized_return': portfolio_returns.mean() * 252,
-            'volatility': self.calculate_volatility(portfolio_returns),
-            'sharpe_ratio': self.calculate_sharpe_ratio(portfolio_returns),
-            'sortino_ratio': self.calculate_sortino_ratio(portfolio_returns),
-            'var_95': self.calculate_var(portfolio_returns, 0.95),
-            'cvar_95': self.calculate_cvar(portfolio_returns, 0.95),
+            'total_return': wealth[-1] - 1,
+            'annualized_return': mean * 252,
+            'volatility': std * np.sqrt(252),
+            'sharpe_ratio': mean_excess / std * np.sqrt(252) if std > 0 else 0.0,
+            'var_95': var_95,
+            'cvar_95': tail.mean() if len(tail) else var_95,
         }
         
-        # Calculate beta if market data is available
-        if market_prices is not None:
-            market_returns = self.calculate_returns(market_prices)
-            metrics['beta'] = self.calculate_beta(portfolio_returns, market_returns)
-            metrics['information_ratio'] = self.calculate_information_ratio(
-                portfolio_returns, market_returns
-            )
+        if len(downside) == 0:
+            metrics['sortino_ratio'] = float('inf')  # No downside risk
         else:
-            metrics['beta'] = 1.0
-            metrics['information_ratio'] = 0.0
-        
-        # Calculate maximum drawdown
-        if len(portfolio_returns) > 1:
-            cumulative_prices = (1 + portfolio_returns).cumprod()
-            max_dd, peak_date, trough_date = self.calculate_maximum_drawdown(
-                pd.Series(cumulative_prices.values, index=cumulative_prices.index)
+            downside_deviation = downside.std(ddof=1) if len(downside) > 1 else 0.0
+            metrics['sortino_ratio'] = (
+                mean_excess / downside_deviation * np.sqrt(252) if downside_deviation > 0 else float('inf')
             )
-            metrics['max_drawdown'] = max_dd
+        
+        # Beta and information ratio against the benchmark
+        metrics['beta'] = 1.0
+        metrics['information_ratio'] = 0.0
+        if market_returns is not None:
+            mask = np.isfinite(market_returns)
+            if mask.sum() >= 2:
+                asset = portfolio_returns[mask]
+                market = market_returns[mask]
+                market_variance = market.var(ddof=1)
+                if market_variance != 0:
+                    metrics['beta'] = np.cov(asset, market, ddof=1)[0, 1] / market_variance
+                
+                active = asset - market
+                tracking_error = active.std(ddof=1)
+                if tracking_error != 0:
+                    metrics['information_ratio'] = active.mean() / tracking_error
+        
+        # Maximum drawdown of the cumulative wealth curve
+        if n > 1:
+            running_max = np.maximum.accumulate(wealth)
+            metrics['max_drawdown'] = ((wealth - running_max) / running_max).min()
         else:
             metrics['max_drawdown'] = 0.0
         
+        return {key: float(value) for key, value in metrics.items()}
+    
+    def simulate_portfolio_returns(self,
+                                   returns: np.ndarray,
+                                   weights: np.ndarray,
+                                   paths: int = 10000,
+                                   horizon_days: int = 1,
+                                   seed: Optional[int] = None,
+                                   chunk_size: int = 20000,
+                                   covariance: Optional[np.ndarray] = None) -> np.ndarray:
+        """Monte Carlo compounded portfolio returns over a horizon
+
+        With correlated normal asset returns mu + L z, the daily portfolio
+        return w'(mu + L z) is exactly N(w'mu, w'Sigma w), so each simulated
+        day needs one normal per path rather than one per asset. Paths
+        compound their daily returns over the horizon, which the parametric
+        method (a scaled single-day normal) doesn't capture. Normals are
+        generated in chunks of about chunk_size draws to bound memory. A
+        precomputed covariance of the returns columns can be passed in to
+        skip recomputing it.
+        """
+        mu = returns.mean(axis=0)
+        if covariance is None:
+            covariance = np.cov(returns, rowvar=False)
+        cov = np.atleast_2d(covariance)
+        
+        drift = mu @ weights
+        daily_std = np.sqrt(max(weights @ cov @ weights, 0.0))
+        
+        rng = np.random.default_rng(seed)
+        simulated = np.empty(paths, dtype=np.float64)
+        rows = max(chunk_size // horizon_days, 1)
+        for start in range(0, paths, rows):
+            stop = min(start + rows, paths)
+            daily = rng.standard_normal((stop - start, horizon_days))
+            daily *= daily_std
+            daily += drift
+            if horizon_days == 1:
+                simulated[start:stop] = daily[:, 0]
+            else:
+                daily += 1.0
+                np.prod(daily, axis=1, out=simulated[start:stop])
+                simulated[start:stop] -= 1.0
+        return simulated
+    
+    def calculate_var_cvar(self,
+                           returns: np.ndarray,
+                           weights: np.ndarray,
+                           confidence_level: float = 0.95,
+                           method: str = 'historical',
+                           horizon_days: int = 1,
+                           paths: int = 10000,
+                           seed: Optional[int] = None,
+                           covariance: Optional[np.ndarray] = None) -> Tuple[float, float]:
+        """VaR and CVaR of a portfolio over a horizon from an aligned returns matrix
+
+        covariance optionally supplies the asset covariance (e.g. from a
+        CovarianceCache) for the parametric and Monte Carlo methods.
+        """
+        portfolio_returns = returns @ weights
+        
+        if method == 'historical':
+            # Overlapping horizon-day returns from the observed history
+            if horizon_days > 1:
+                cumulative = np.concatenate([[0.0], np.cumsum(portfolio_returns)])
+                portfolio_returns = cumulative[horizon_days:] - cumulative[:-horizon_days]
+            samples = portfolio_returns
+        
+        elif method == 'parametric':
+            mean = portfolio_returns.mean() * horizon_days
+            if covariance is not None:
+                daily_std = np.sqrt(max(weights @ np.atleast_2d(covariance) @ weights, 0.0))
+            else:
+                daily_std = portfolio_returns.std(ddof=1)
+            std = daily_std * np.sqrt(horizon_days)
+            alpha = 1 - confidence_level
+            var = mean + norm.ppf(alpha) * std
+            cvar = mean - std * norm.pdf(norm.ppf(alpha)) / alpha
+            return float(var), float(cvar)
+        
+        elif method == 'monte_carlo':
+            samples = self.simulate_portfolio_returns(
+                returns, weights, paths=paths, horizon_days=horizon_days, seed=seed,
+                covariance=covariance
+            )
+        
+        else:
+            raise ValueError("Method must be 'historical', 'parametric' or 'monte_carlo'")
+        
+        if len(samples) == 0:
+            return 0.0, 0.0
+        
+        var = np.percentile(samples, (1 - confidence_level) * 100)
+        tail = samples[samples <= var]
+        cvar = tail.mean() if len(tail) else var
+        return float(var), float(cvar)
+    
+    def calculate_portfolio_metrics(self,
+                                  asset_prices: Dict[str, pd.Series],
+                                  weights: Dict[str, float],
+                                  market_prices: Optional[pd.Series] = None,
+                                  var_method: Optional[str] = None,
+                                  confidence_level: float = 0.95,
+                                  horizon_days: int = 1,
+                                  paths: int = 10000,
+                                  seed: Optional[int] = None,
+                                  covariance_cache=None) -> Dict[str, float]:
+        """Calculate comprehensive portfolio risk metrics
+
+        When var_method is given, 'var' and 'cvar' are added at the requested
+        confidence level and horizon using that method. Parametric and Monte
+        Carlo VaR take the asset covariance from covariance_cache when given.
+        """
+        symbols, index, returns = self.build_returns_matrix(asset_prices)
+        
+        if len(returns) == 0:
+            return self._empty_metrics()
+        
+        # Portfolio returns as one matrix-vector product
+        weights_vector = self.weights_vector(symbols, weights)
+        portfolio_returns = returns @ weights_vector
+        
+        market_returns = None
+        if market_prices is not None:
+            market_returns = self.align_market_returns(market_prices, index)
+        
+        metrics = self.calculate_metrics_from_returns(portfolio_returns, market_returns)
+        
+        if var_method is not None:
+            covariance = None
+            if covariance_cache is not None and var_method != 'historical' and len(returns) > 1:
+                covariance, _ = covariance_cache.get(symbols, index, returns)
+            metrics['var'], metrics['cvar'] = self.calculate_var_cvar(
+                returns, weights_vector,
+                confidence_level=confidence_level,
+                method=var_method,
+                horizon_days=horizon_days,
+                paths=paths,
+                seed=seed,
+                covariance=covariance
+            )
+        
         return metrics
     
+    def calculate_batch_metrics(self,
+                                asset_prices: Dict[str, pd.Series],
+                                weights_list: List[Dict[str, float]],
+                                market_prices: Optional[pd.Series] = None) -> List[Dict[str, float]]:
+        """Calculate metrics for many portfolios, sharing one returns matrix per holding set
+
+        Every portfolio is aligned on the dates its own holdings share, as in
+        calculate_portfolio_metrics, so a recently listed symbol in one
+        portfolio doesn't truncate the others. Portfolios holding the same
+        symbols are evaluated together as the columns of R @ W.
+        """
+        results = [self._empty_metrics() for _ in weights_list]
+        
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for i, weights in enumerate(weights_list):
+            held = tuple(sorted(symbol for symbol in weights if symbol in asset_prices))
+            if held:
+                groups.setdefault(held, []).append(i)
+        
+        for held, members in groups.items():
+            symbols, index, returns = self.build_returns_matrix(
+                {symbol: asset_prices[symbol] for symbol in held}
+            )
+            if len(returns) == 0:
+                continue
+            
+            # (assets x portfolios) weights, so every portfolio is one column of R @ W
+            weight_matrix = np.column_stack([self.weights_vector(symbols, weights_list[i]) for i in members])
+            portfolio_returns = returns @ weight_matrix
+            
+            market_returns = None
+            if market_prices is not None:
+                market_returns = self.align_market_returns(market_prices, index)
+            
+            for column, i in enumerate(members):
+                results[i] = self.calculate_metrics_from_returns(
+                    np.ascontiguousarray(portfolio_returns[:, column]), market_returns
+                )
+        
+        return results
+    
     def _empty_metrics(self) -> Dict[str, float]:
         """Return empty metrics when calculation is not possible"""
         return {
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class RiskExecutorBusy(RuntimeError):
+    """Raised when the risk executor queue is full"""
+
+
+def _timed_call(fn: Callable, args: tuple):
+    """Run fn in the worker and report how long it actually ran"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class RiskExecutor:
+    """Runs CPU-heavy risk calculations off the event loop
+
+    mode is "thread" (NumPy releases the GIL for the heavy kernels),
+    "process" (arguments are pickled to worker processes) or "inline".
+    At most max_workers + max_queue calls are accepted at once; the rest
+    are rejected with RiskExecutorBusy instead of piling up behind the pool.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: int = 4, max_queue: int = 32):
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_in_flight = max_workers + max_queue
+        self._pool: Optional[Executor] = None
+        if mode == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="risk")
+        elif mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=max_workers)
+        elif mode != "inline":
+            raise ValueError("Mode must be 'thread', 'process' or 'inline'")
+
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) on the pool and await its result
+
+        A call stays in flight until the worker finishes it, even if the
+        awaiting request is cancelled, so the limit counts real work.
+        """
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise RiskExecutorBusy(f"Risk executor is busy ({self.in_flight} calls in flight)")
+
+        self.in_flight += 1
+        self.submitted += 1
+        submitted_at = time.perf_counter()
+        if self._pool is None:
+            try:
+                result, run_seconds = _timed_call(fn, args)
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+            self._record(submitted_at, run_seconds)
+            return result
+
+        loop = asyncio.get_running_loop()
+        job = self._pool.submit(_timed_call, fn, args)
+        job.add_done_callback(lambda done: self._call_soon(loop, self._finish, done, submitted_at))
+        result, _ = await asyncio.wrap_future(job)
+        return result
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, callback: Callable, *args):
+        """Hand a worker-thread completion back to the event loop"""
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # Loop already closed during shutdown
+
+    def _finish(self, job, submitted_at: float):
+        self.in_flight -= 1
+        if job.cancelled():
+            return
+        if job.exception() is not None:
+            self.failed += 1
+            return
+        self._record(submitted_at, job.result()[1])
+
+    def _record(self, submitted_at: float, run_seconds: float):
+        wait_seconds = max(time.perf_counter() - submitted_at - run_seconds, 0.0)
+        self.completed += 1
+        self.total_run_seconds += run_seconds
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and timing counters"""
+        return {
+            'mode': self.mode,
+            'max_workers': self.max_workers,
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self.in_flight,
+            'queued': max(self.in_flight - self.max_workers, 0),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_wait_ms': 1000 * self.total_wait_seconds / self.completed if self.completed else 0.0,
+            'max_wait_ms': 1000 * self.max_wait_seconds,
+            'avg_run_ms': 1000 * self.total_run_seconds / self.completed if self.completed else 0.0,
+        }
@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight task"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() for key, or await the call already in flight for it"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+
+        # Shield so one cancelled caller doesn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def do_many(self,
+                      keys: List[Hashable],
+                      fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]) -> Dict[Hashable, Any]:
+        """Batch version of do: join keys already in flight, load the rest with one fn call
+
+        fn takes the keys to load and returns {key: value}; a value may be an
+        exception instance, raised to that key's callers only. Each key gets
+        its own in-flight task, so later callers (batch or single) can join
+        it. Returns {key: value or exception} for every key.
+        """
+        tasks: Dict[Hashable, asyncio.Task] = {}
+        new = []
+        for key in dict.fromkeys(keys):
+            task = self._inflight.get(key)
+            if task is None:
+                new.append(key)
+            else:
+                self.coalesced += 1
+                tasks[key] = task
+
+        if new:
+            self.calls += 1
+            batch = asyncio.ensure_future(fn(new))
+            for key in new:
+                task = asyncio.ensure_future(self._pick(batch, key))
+                self._inflight[key] = task
+                task.add_done_callback(lambda done, key=key: self._forget(key, done))
+                tasks[key] = task
+
+        results = await asyncio.gather(
+            *[asyncio.shield(task) for task in tasks.values()], return_exceptions=True
+        )
+        return dict(zip(tasks, results))
+
+    @staticmethod
+    async def _pick(batch: "asyncio.Future", key: Hashable) -> Any:
+        value = (await batch).get(key)
+        if isinstance(value, BaseException):
+            raise value
+        return value
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Return upstream call and coalescing counters"""
+        return {
+            'in_flight': len(self._inflight),
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+        }
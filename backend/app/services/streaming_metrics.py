@@ -0,0 +1,156 @@
+import bisect
+import math
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class RollingQuantile:
+    """Quantiles over the last `window` values, kept in a sorted buffer"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._values = deque()
+        self._sorted: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, value: float):
+        self._values.append(value)
+        bisect.insort(self._sorted, value)
+        if len(self._values) > self.window:
+            oldest = self._values.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+
+    def quantile(self, q: float) -> float:
+        """Linearly interpolated quantile, matching np.percentile"""
+        if not self._sorted:
+            return 0.0
+        position = q * (len(self._sorted) - 1)
+        lower = int(math.floor(position))
+        upper = min(lower + 1, len(self._sorted) - 1)
+        fraction = position - lower
+        return self._sorted[lower] + (self._sorted[upper] - self._sorted[lower]) * fraction
+
+
+class StreamingSymbolMetrics:
+    """Risk metrics for one symbol, updated in O(1) per new price
+
+    Keeps Welford running moments of tick returns, a running co-moment with
+    the benchmark over the same intervals, the running price peak for
+    drawdown and a rolling window of returns for VaR.
+    """
+
+    def __init__(self, symbol: str, var_window: int = 500, confidence_level: float = 0.95):
+        self.symbol = symbol
+        self.confidence_level = confidence_level
+        self.last_price: Optional[float] = None
+        self.last_benchmark: Optional[float] = None
+        self.last_updated: Optional[datetime] = None
+
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.benchmark_mean = 0.0
+        self._benchmark_m2 = 0.0
+        self._comoment = 0.0
+
+        self.peak_price: Optional[float] = None
+        self.max_drawdown = 0.0
+        self.returns_window = RollingQuantile(var_window)
+
+    def update(self, price: float, benchmark_price: Optional[float] = None):
+        """Fold one new price (and the benchmark at the same tick) into the metrics"""
+        if price is None or price <= 0:
+            return
+
+        if self.last_price is not None:
+            r = price / self.last_price - 1
+            # Benchmark return over the same interval as this symbol's return
+            if benchmark_price and self.last_benchmark:
+                b = benchmark_price / self.last_benchmark - 1
+            else:
+                b = 0.0
+
+            self.count += 1
+            delta = r - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (r - self.mean)
+
+            benchmark_delta = b - self.benchmark_mean
+            self.benchmark_mean += benchmark_delta / self.count
+            self._benchmark_m2 += benchmark_delta * (b - self.benchmark_mean)
+            self._comoment += delta * (b - self.benchmark_mean)
+
+            self.returns_window.add(r)
+
+        self.peak_price = price if self.peak_price is None else max(self.peak_price, price)
+        self.max_drawdown = min(self.max_drawdown, price / self.peak_price - 1)
+
+        self.last_price = price
+        if benchmark_price:
+            self.last_benchmark = benchmark_price
+        self.last_updated = datetime.now()
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def beta(self) -> float:
+        if self.count < 2 or self._benchmark_m2 == 0:
+            return 1.0
+        return self._comoment / self._benchmark_m2
+
+    def snapshot(self) -> Dict:
+        """Current metrics as a plain dict"""
+        var = self.returns_window.quantile(1 - self.confidence_level)
+        return {
+            'symbol': self.symbol,
+            'last_price': self.last_price,
+            'observations': self.count,
+            'mean_return': self.mean,
+            'volatility': math.sqrt(self.variance),
+            'beta': self.beta,
+            'var': var,
+            'current_drawdown': self.last_price / self.peak_price - 1 if self.peak_price else 0.0,
+            'max_drawdown': self.max_drawdown,
+            'last_updated': self.last_updated,
+        }
+
+
+class StreamingMetricsRegistry:
+    """Intraday streaming metrics for every symbol seen by the price loop"""
+
+    def __init__(self, benchmark_symbol: str = 'SPY', var_window: int = 500):
+        self.benchmark_symbol = benchmark_symbol
+        self.var_window = var_window
+        self.metrics: Dict[str, StreamingSymbolMetrics] = {}
+        self._last_prices: Dict[str, float] = {}
+
+    def update(self, prices: Dict[str, float]):
+        """Feed one tick of prices
+
+        Every tick is a fresh upstream quote, so an unchanged price is a
+        real zero return and is counted like any other observation.
+        """
+        benchmark_price = prices.get(self.benchmark_symbol) or self._last_prices.get(self.benchmark_symbol)
+
+        for symbol, price in prices.items():
+            if price is None:
+                continue
+            self._last_prices[symbol] = price
+
+            tracker = self.metrics.get(symbol)
+            if tracker is None:
+                tracker = self.metrics[symbol] = StreamingSymbolMetrics(symbol, self.var_window)
+            tracker.update(price, benchmark_price)
+
+    def get_snapshot(self, symbols: List[str]) -> Dict[str, Dict]:
+        """Snapshots for the requested symbols that have been seen"""
+        return {
+            symbol: self.metrics[symbol].snapshot()
+            for symbol in symbols
+            if symbol in self.metrics
+        }
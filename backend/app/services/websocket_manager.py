@@ -1,31 +1,142 @@
+import asyncio
 import json
-from typing import Dict, List, Set
+import time
+from datetime import datetime
+from typing import Callable, Deque, Dict, FrozenSet, List, Optional, Set
 from fastapi import WebSocket
-from collections import defaultdict
+from collections import defaultdict, deque
+from ..core.config import settings
+
+
+class ConnectionWriter:
+    """Bounded outbound queue and writer task for a single connection
+    
+    Price frames are queued pre-serialized. Once the queue is full the
+    connection switches to conflation: only the latest price per symbol is
+    kept and sent as one merged frame when the writer catches up. Control
+    messages (confirmations etc.) are never conflated.
+    """
+    
+    def __init__(self,
+                 websocket: WebSocket,
+                 max_queue: int,
+                 on_error: Callable[[WebSocket], None]):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.on_error = on_error
+        self.control: Deque[str] = deque()
+        self.queue: Deque[str] = deque()
+        self.conflated: Dict[str, float] = {}
+        self.behind_since: Optional[float] = None
+        self.sent = 0
+        self.conflated_updates = 0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+    
+    def send_control(self, message: str):
+        """Queue a message that must be delivered as-is"""
+        self.control.append(message)
+        self._wakeup.set()
+    
+    def send_prices(self, message: str, symbol_prices: Dict[str, float]):
+        """Queue a pre-serialized price frame, conflating if the queue is full"""
+        if self.conflated or len(self.queue) >= self.max_queue:
+            # Keep ordering: once conflating, newer prices go to the merge buffer
+            self.conflated.update(symbol_prices)
+            self.conflated_updates += 1
+            if self.behind_since is None:
+                self.behind_since = time.monotonic()
+        else:
+            self.queue.append(message)
+        self._wakeup.set()
+    
+    def is_slow(self, timeout: float) -> bool:
+        """Whether the connection has been behind for longer than timeout"""
+        return self.behind_since is not None and time.monotonic() - self.behind_since > timeout
+    
+    @property
+    def depth(self) -> int:
+        return len(self.control) + len(self.queue) + (1 if self.conflated else 0)
+    
+    def close(self):
+        """Stop the writer task"""
+        self._task.cancel()
+    
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                
+                while self.control or self.queue or self.conflated:
+                    if self.control:
+                        message = self.control.popleft()
+                    elif self.queue:
+                        message = self.queue.popleft()
+                    else:
+                        message = json.dumps({
+                            "type": "price_update",
+                            "data": self.conflated,
+                            "timestamp": datetime.now().isoformat()
+                        })
+                        self.conflated = {}
+                    
+                    await self.websocket.send_text(message)
+                    self.sent += 1
+                
+                # Fully drained: the connection has caught up
+                self.behind_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending message to WebSocket: {e}")
+            self.on_error(self.websocket)
 
 
 class WebSocketManager:
     """Manages WebSocket connections and message broadcasting"""
     
-    def __init__(self):
+    def __init__(self,
+                 send_queue_size: int = settings.WS_SEND_QUEUE_SIZE,
+                 slow_consumer_timeout: float = settings.WS_SLOW_CONSUMER_TIMEOUT,
+                 change_threshold_bps: float = settings.WS_PRICE_CHANGE_THRESHOLD_BPS):
         # Active connections
         self.active_connections: List[WebSocket] = []
         # Symbol subscriptions per connection
         self.subscriptions: Dict[WebSocket, Set[str]] = defaultdict(set)
         # Reverse mapping: symbol -> set of connections
         self.symbol_subscribers: Dict[str, Set[WebSocket]] = defaultdict(set)
+        # Connections grouped by identical subscription sets, rebuilt lazily
+        self._subscription_groups: Optional[Dict[FrozenSet[str], List[WebSocket]]] = None
+        # Outbound writer per connection
+        self.writers: Dict[WebSocket, ConnectionWriter] = {}
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_timeout = slow_consumer_timeout
+        # Last price broadcast per symbol; every subscriber has seen it (or got a snapshot)
+        self.last_sent_prices: Dict[str, float] = {}
+        self.change_threshold_bps = change_threshold_bps
+        # Broadcast counters
+        self.payloads_serialized = 0
+        self.messages_sent = 0
+        self.slow_consumers_evicted = 0
+        self.updates_suppressed = 0
     
     async def connect(self, websocket: WebSocket):
         """Accept a new WebSocket connection"""
         await websocket.accept()
         self.active_connections.append(websocket)
         self.subscriptions[websocket] = set()
+        self.writers[websocket] = ConnectionWriter(websocket, self.send_queue_size, self.disconnect)
     
     def disconnect(self, websocket: WebSocket):
         """Remove a WebSocket connection"""
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
         
+        writer = self.writers.pop(websocket, None)
+        if writer is not None:
+            writer.close()
+        
         # Remove from symbol subscriptions
         if websocket in self.subscriptions:
             symbols = self.subscriptions[websocket].copy()
@@ -33,19 +144,40 @@ class WebSocketManager:
                 self.symbol_subscribers[symbol].discard(websocket)
                 if not self.symbol_subscribers[symbol]:
                     del self.symbol_subscribers[symbol]
+                    self.last_sent_prices.pop(symbol, None)
             del self.subscriptions[websocket]
+            self._subscription_groups = None
     
-    async def subscribe_symbols(self, websocket: WebSocket, symbols: List[str]):
-        """Subscribe a connection to specific symbols"""
+    async def subscribe_symbols(self, websocket: WebSocket, symbols: List[str], snapshot: bool = True):
+        """Subscribe a connection to specific symbols
+
+        With snapshot, the last broadcast prices for the symbols are sent right
+        away, since later broadcasts only carry symbols whose price changed.
+        """
         for symbol in symbols:
             self.subscriptions[websocket].add(symbol)
             self.symbol_subscribers[symbol].add(websocket)
+        self._subscription_groups = None
         
         # Send confirmation
-        await websocket.send_text(json.dumps({
+        await self.send_personal_message(json.dumps({
             "type": "subscription_confirmed",
             "symbols": symbols
-        }))
+        }), websocket)
+        
+        if snapshot:
+            snapshot_prices = {
+                symbol: self.last_sent_prices[symbol]
+                for symbol in symbols
+                if symbol in self.last_sent_prices
+            }
+            if snapshot_prices:
+                await self.send_personal_message(json.dumps({
+                    "type": "price_update",
+                    "data": snapshot_prices,
+                    "timestamp": datetime.now().isoformat(),
+                    "snapshot": True
+                }), websocket)
     
     async def unsubscribe_symbols(self, websocket: WebSocket, symbols: List[str]):
         """Unsubscribe a connection from specific symbols"""
@@ -54,66 +186,121 @@ class WebSocketManager:
             self.symbol_subscribers[symbol].discard(websocket)
             if not self.symbol_subscribers[symbol]:
                 del self.symbol_subscribers[symbol]
+                self.last_sent_prices.pop(symbol, None)
+        self._subscription_groups = None
         
         # Send confirmation
-        await websocket.send_text(json.dumps({
+        await self.send_personal_message(json.dumps({
             "type": "unsubscription_confirmed",
             "symbols": symbols
-        }))
+        }), websocket)
     
     def get_all_subscribed_symbols(self) -> List[str]:
         """Get all symbols that have at least one subscriber"""
         return list(self.symbol_subscribers.keys())
     
+    def get_subscriber_counts(self) -> Dict[str, int]:
+        """Number of subscribers per subscribed symbol"""
+        return {symbol: len(connections) for symbol, connections in self.symbol_subscribers.items()}
+    
+    def get_subscription_groups(self) -> Dict[FrozenSet[str], List[WebSocket]]:
+        """Connections grouped by identical subscription sets"""
+        if self._subscription_groups is None:
+            groups: Dict[FrozenSet[str], List[WebSocket]] = defaultdict(list)
+            for websocket, symbols in self.subscriptions.items():
+                if symbols:
+                    groups[frozenset(symbols)].append(websocket)
+            self._subscription_groups = dict(groups)
+        return self._subscription_groups
+    
+    def filter_changed_prices(self, prices: Dict[str, float]) -> Dict[str, float]:
+        """Keep only prices that moved past the threshold since they were last sent"""
+        changed = {}
+        for symbol, price in prices.items():
+            last_price = self.last_sent_prices.get(symbol)
+            if last_price is None or (
+                price != last_price
+                and abs(price - last_price) * 10000 >= self.change_threshold_bps * abs(last_price)
+            ):
+                changed[symbol] = price
+        
+        self.updates_suppressed += len(prices) - len(changed)
+        return changed
+    
     async def broadcast_prices(self, prices: Dict[str, float]):
         """Broadcast price updates to subscribed connections"""
+        # Only subscribed symbols whose price actually changed go out
+        prices = self.filter_changed_prices({
+            symbol: price for symbol, price in prices.items()
+            if symbol in self.symbol_subscribers and price is not None
+        })
+        self.last_sent_prices.update(prices)
+        
         if not prices:
+            self.evict_slow_consumers()
             return
         
-        # Group connections by the symbols they're subscribed to
-        messages_to_send: Dict[WebSocket, Dict[str, float]] = defaultdict(dict)
-        
-        for symbol, price in prices.items():
-            if symbol in self.symbol_subscribers:
-                for websocket in self.symbol_subscribers[symbol]:
-                    messages_to_send[websocket][symbol] = price
+        timestamp = datetime.now().isoformat()
         
-        # Send messages
-        disconnected_connections = []
-        for websocket, symbol_prices in messages_to_send.items():
-            try:
-                message = {
-                    "type": "price_update",
-                    "data": symbol_prices,
-                    "timestamp": json.dumps(None, default=str)  # Will be replaced by current time
-                }
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                print(f"Error sending message to WebSocket: {e}")
-                disconnected_connections.append(websocket)
+        # Serialize each distinct payload once and hand it to every writer in the group
+        for symbols, connections in self.get_subscription_groups().items():
+            symbol_prices = {symbol: prices[symbol] for symbol in symbols if symbol in prices}
+            if not symbol_prices:
+                continue
+            
+            message = json.dumps({
+                "type": "price_update",
+                "data": symbol_prices,
+                "timestamp": timestamp
+            })
+            self.payloads_serialized += 1
+            for websocket in connections:
+                writer = self.writers.get(websocket)
+                if writer is not None:
+                    writer.send_prices(message, symbol_prices)
+                    self.messages_sent += 1
         
-        # Clean up disconnected connections
-        for websocket in disconnected_connections:
+        self.evict_slow_consumers()
+    
+    def evict_slow_consumers(self):
+        """Disconnect clients that have stayed behind for too long"""
+        slow = [
+            websocket for websocket, writer in self.writers.items()
+            if writer.is_slow(self.slow_consumer_timeout)
+        ]
+        for websocket in slow:
+            print(f"Disconnecting slow WebSocket consumer (behind > {self.slow_consumer_timeout}s)")
+            self.slow_consumers_evicted += 1
             self.disconnect(websocket)
+            asyncio.create_task(self._close_quietly(websocket))
+    
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), timeout=5)
+        except Exception:
+            pass
+    
+    def stats(self) -> Dict[str, int]:
+        """Return connection and broadcast counters"""
+        return {
+            'connections': len(self.active_connections),
+            'subscribed_symbols': len(self.symbol_subscribers),
+            'subscription_groups': len(self.get_subscription_groups()),
+            'payloads_serialized': self.payloads_serialized,
+            'messages_sent': self.messages_sent,
+            'queued_messages': sum(writer.depth for writer in self.writers.values()),
+            'conflating_connections': sum(1 for writer in self.writers.values() if writer.conflated),
+            'slow_consumers_evicted': self.slow_consumers_evicted,
+            'updates_suppressed': self.updates_suppressed,
+        }
     
     async def send_personal_message(self, message: str, websocket: WebSocket):
         """Send a message to a specific connection"""
-        try:
-            await websocket.send_text(message)
-        except Exception as e:
-            print(f"Error sending personal message: {e}")
-            self.disconnect(websocket)
+        writer = self.writers.get(websocket)
+        if writer is not None:
+            writer.send_control(message)
     
     async def broadcast_to_all(self, message: str):
         """Broadcast a message to all connected clients"""
-        disconnected_connections = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Error broadcasting to connection: {e}")
-                disconnected_connections.append(connection)
-        
-        # Clean up disconnected connections
-        for connection in disconnected_connections:
-            self.disconnect(connection)
+        for writer in self.writers.values():
+            writer.send_control(message)
@@ -3,13 +3,23 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import asyncio
 import json
-from typing import List
+import time
+from typing import Dict
+import redis.asyncio as redis
 
 from app.core.config import settings
-from app.core.database import engine, Base
+from app.core.database import engine, Base, get_pool_stats
+from app.core.security import password_hasher
 from app.api import auth, portfolios, market_data
 from app.services.websocket_manager import WebSocketManager
 from app.services.market_data_service import MarketDataService
+from app.services.risk_executor import RiskExecutor
+from app.services.covariance_cache import CovarianceCache
+from app.services.risk_cache import RiskResultCache
+from app.services.streaming_metrics import StreamingMetricsRegistry
+from app.services.price_scheduler import PriceScheduler
+from app.services.redis_cache import RedisMarketCache
+from app.services.price_broker import PriceBroker, InMemoryPriceBroker, RedisPriceBroker
 
 
 # Create database tables
@@ -19,21 +29,85 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     
+    # Shared Redis layer for multi-worker and multi-node deployments
+    redis_client = None
+    shared_cache = None
+    if settings.REDIS_ENABLED or settings.PRICE_BROKER == "redis":
+        redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    if settings.REDIS_ENABLED:
+        shared_cache = RedisMarketCache(
+            redis_client,
+            price_ttl=settings.PRICE_CACHE_TTL,
+            history_ttl=settings.REDIS_HISTORY_TTL
+        )
+    
+    if settings.PRICE_BROKER == "redis":
+        price_broker = RedisPriceBroker(redis_client, registration_ttl=settings.BROKER_REGISTRATION_TTL)
+    else:
+        price_broker = InMemoryPriceBroker()
+    
     # Start market data service
-    market_service = MarketDataService()
+    market_service = MarketDataService(shared_cache=shared_cache)
     websocket_manager = WebSocketManager()
+    risk_executor = RiskExecutor(
+        mode=settings.RISK_EXECUTOR,
+        max_workers=settings.RISK_EXECUTOR_WORKERS,
+        max_queue=settings.RISK_EXECUTOR_MAX_QUEUE
+    )
+    covariance_cache = CovarianceCache(max_bytes=settings.COVARIANCE_CACHE_MAX_BYTES)
+    risk_cache = RiskResultCache(
+        ttl=settings.RISK_CACHE_TTL,
+        stale_ttl=settings.RISK_CACHE_STALE_TTL,
+        stale_while_revalidate=settings.RISK_CACHE_STALE_WHILE_REVALIDATE,
+        max_size=settings.RISK_CACHE_MAX_SIZE
+    )
+    streaming_metrics = StreamingMetricsRegistry()
+    price_scheduler = PriceScheduler(
+        base_interval=settings.PRICE_REFRESH_BASE_INTERVAL,
+        min_interval=settings.PRICE_REFRESH_MIN_INTERVAL,
+        max_interval=settings.PRICE_REFRESH_MAX_INTERVAL,
+        off_hours_multiplier=settings.PRICE_REFRESH_OFF_HOURS_MULTIPLIER,
+        rate_limits={
+            "polygon": settings.POLYGON_REQUESTS_PER_MINUTE,
+            "alpha_vantage": settings.ALPHA_VANTAGE_REQUESTS_PER_MINUTE,
+        },
+        backoff_base=settings.PROVIDER_BACKOFF_BASE,
+        backoff_cap=settings.PROVIDER_BACKOFF_CAP
+    )
     
     # Store services in app state
     app.state.market_service = market_service
     app.state.websocket_manager = websocket_manager
+    app.state.risk_executor = risk_executor
+    app.state.covariance_cache = covariance_cache
+    app.state.risk_cache = risk_cache
+    app.state.streaming_metrics = streaming_metrics
+    app.state.price_scheduler = price_scheduler
+    app.state.price_broker = price_broker
     
     # Start background task for price updates
-    asyncio.create_task(price_update_task(market_service, websocket_manager))
+    app.state.price_task = asyncio.create_task(
+        price_update_task(market_service, websocket_manager, streaming_metrics, price_scheduler, price_broker)
+    )
+    
+    # Every node broadcasts every published tick to its own clients
+    app.state.listen_task = asyncio.create_task(price_broker.listen(
+        lambda prices: handle_price_tick(prices, websocket_manager, streaming_metrics)
+    ))
     
     yield
     
-    # Shutdown
+    # Shutdown: stop the background loops before closing what they use
+    background_tasks = [app.state.price_task, app.state.listen_task]
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
     await market_service.close()
+    risk_executor.shutdown()
+    password_hasher.shutdown()
+    await price_broker.close()
+    if redis_client is not None:
+        await redis_client.aclose()
 
 
 app = FastAPI(
@@ -72,6 +146,34 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for caches and worker pools"""
+    return {
+        "market_data": app.state.market_service.get_cache_stats(),
+        "risk_executor": app.state.risk_executor.stats(),
+        "covariance_cache": app.state.covariance_cache.stats(),
+        "risk_cache": app.state.risk_cache.stats(),
+        "database": get_pool_stats(),
+        "auth": {**password_hasher.stats(), "user_cache": auth.user_cache.stats()},
+        "websockets": app.state.websocket_manager.stats(),
+        "price_scheduler": app.state.price_scheduler.stats(),
+        "cluster": await app.state.price_broker.get_cluster_stats(),
+    }
+
+
+@app.get("/metrics/db")
+async def database_metrics():
+    """Connection pool usage: checked-out connections, checkout wait time and overflow events"""
+    return get_pool_stats()
+
+
+@app.get("/cluster")
+async def cluster():
+    """Per-node connection counts and symbol sets, for autoscaling decisions"""
+    return await app.state.price_broker.get_cluster_stats()
+
+
 @app.websocket("/ws/prices")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time price updates"""
@@ -84,7 +186,8 @@ async def websocket_endpoint(websocket: WebSocket):
             
             if message.get("type") == "subscribe":
                 symbols = message.get("symbols", [])
-                await app.state.websocket_manager.subscribe_symbols(websocket, symbols)
+                snapshot = message.get("snapshot", True)
+                await app.state.websocket_manager.subscribe_symbols(websocket, symbols, snapshot)
             elif message.get("type") == "unsubscribe":
                 symbols = message.get("symbols", [])
                 await app.state.websocket_manager.unsubscribe_symbols(websocket, symbols)
@@ -93,26 +196,60 @@ async def websocket_endpoint(websocket: WebSocket):
         app.state.websocket_manager.disconnect(websocket)
 
 
-async def price_update_task(market_service: MarketDataService, websocket_manager: WebSocketManager):
-    """Background task to fetch and broadcast price updates"""
+async def handle_price_tick(prices: Dict[str, float],
+                            websocket_manager: WebSocketManager,
+                            streaming_metrics: StreamingMetricsRegistry):
+    """Fold one tick into the intraday metrics and broadcast it to local clients"""
+    streaming_metrics.update(prices)
+    await websocket_manager.broadcast_prices(prices)
+
+
+async def price_update_task(market_service: MarketDataService,
+                            websocket_manager: WebSocketManager,
+                            streaming_metrics: StreamingMetricsRegistry,
+                            price_scheduler: PriceScheduler,
+                            price_broker: PriceBroker):
+    """Background task to fetch and publish price updates"""
     while True:
+        provider, batch_size = market_service.get_quote_provider()
         try:
-            # Get all subscribed symbols
-            symbols = websocket_manager.get_all_subscribed_symbols()
+            local_counts = websocket_manager.get_subscriber_counts()
+            await price_broker.register_node(local_counts, len(websocket_manager.active_connections))
+            
+            # Symbols this node polls (its share of its clients' symbols, plus
+            # the benchmark for streaming beta), with cluster-wide subscriber counts
+            subscriber_counts = await price_broker.get_poll_assignment(
+                local_counts, [streaming_metrics.benchmark_symbol]
+            )
+            price_scheduler.forget(subscriber_counts)
+            # Provider limits are per API key, so every node polls on its share of them
+            price_scheduler.set_node_count(await price_broker.live_nodes())
+            
+            # Charge the budget for quote requests sent since the last cycle, then pick
+            # only symbols whose refresh interval has elapsed, within what is left
+            price_scheduler.record_requests(provider, market_service.quote_requests)
+            symbols = price_scheduler.due_symbols(subscriber_counts, provider, batch_size)
             
             if symbols:
-                # Fetch latest prices
-                prices = await market_service.get_multiple_prices(symbols)
-                
-                # Broadcast to all connected clients
-                await websocket_manager.broadcast_prices(prices)
+                cycle_started = time.perf_counter()
+                # Due symbols are quoted upstream (a cached price would be a stale repeat);
+                # any failed request raises, so the provider gets backed off and no mock
+                # price is ever published as a tick
+                prices = await market_service.get_multiple_prices(
+                    symbols, raise_on_error=True, refresh=True
+                )
+                await price_broker.publish_prices(prices)
+                price_scheduler.record_refresh(
+                    provider, prices, time.perf_counter() - cycle_started, requested=symbols
+                )
             
-            # Wait 5 seconds before next update
-            await asyncio.sleep(5)
+            # Sleep until the next symbol is due
+            await asyncio.sleep(price_scheduler.next_wakeup(subscriber_counts, provider))
             
         except Exception as e:
-            print(f"Error in price update task: {e}")
-            await asyncio.sleep(10)  # Wait longer on error
+            delay = price_scheduler.record_failure(provider)
+            print(f"Error in price update task ({provider}), backing off {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+"""Login storm load test: /health and websocket latency must stay flat
+
+Against a running API (default), it measures /health latency, websocket
+round trips (subscribe -> subscription_confirmed) and gaps between price
+ticks. It does this first while idle, then while --concurrency clients
+log in as fast as they can, and prints p50/p99 for both phases. Tick gaps
+only show up when prices move, since unchanged prices aren't broadcast.
+
+    python scripts/login_storm.py --url http://localhost:8000 --concurrency 40
+
+With --local no server is needed. It measures event-loop lag, using a
+5 ms sleep probe, while --concurrency password verifications run
+synchronously on the loop and then through the PasswordHasher thread
+pool. --scheme swaps the passlib scheme, for environments where bcrypt
+is not usable.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentiles(samples: List[float]) -> str:
+    if not samples:
+        return "no samples"
+    p50, p99 = np.percentile(np.asarray(samples) * 1000, [50, 99])
+    return f"p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  (n={len(samples)})"
+
+
+async def probe_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> List[float]:
+    """Extra delay beyond the requested sleep, i.e. how long the loop was blocked"""
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+    return lags
+
+
+async def run_local(args):
+    from app.core import security
+
+    if args.scheme:
+        security.pwd_context.update(schemes=[args.scheme])
+    hashed = security.get_password_hash(args.password)
+    hasher = security.PasswordHasher(max_concurrency=args.hash_concurrency, max_queue=args.concurrency)
+
+    async def verify_sync():
+        return security.verify_password(args.password, hashed)
+
+    async def verify_pool():
+        return await hasher.verify(args.password, hashed)
+
+    for name, verify in (("synchronous", verify_sync), ("thread pool", verify_pool)):
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_loop_lag(stop))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await asyncio.gather(*[verify() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        lags = await probe
+        print(f"{name:12} {args.concurrency} verifications in {elapsed:.2f}s, "
+              f"loop lag {percentiles(lags)}, max {1000 * max(lags):.1f} ms")
+    hasher.shutdown()
+
+
+async def probe_health(client: httpx.AsyncClient, interval: float, stop: asyncio.Event, samples: List[float]):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/health")
+        if response.status_code == 200:
+            samples.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def probe_websocket(url: str, symbols: List[str], interval: float, stop: asyncio.Event,
+                          round_trips: List[float], tick_gaps: List[float]):
+    import websockets
+
+    ws_url = url.replace("http", "ws", 1) + "/ws/prices"
+    async with websockets.connect(ws_url) as websocket:
+        await websocket.send(json.dumps({"type": "subscribe", "symbols": symbols, "snapshot": False}))
+        pending = None
+        last_tick = None
+        next_probe = time.perf_counter()
+        while not stop.is_set():
+            now = time.perf_counter()
+            if pending is None and now >= next_probe:
+                pending = now
+                await websocket.send(json.dumps({"type": "subscribe", "symbols": symbols[:1], "snapshot": False}))
+            try:
+                message = json.loads(await asyncio.wait_for(websocket.recv(), timeout=interval))
+            except asyncio.TimeoutError:
+                continue
+            now = time.perf_counter()
+            if message.get("type") == "subscription_confirmed" and pending is not None:
+                round_trips.append(now - pending)
+                pending = None
+                next_probe = now + interval
+            elif message.get("type") == "price_update":
+                if last_tick is not None:
+                    tick_gaps.append(now - last_tick)
+                last_tick = now
+
+
+async def login_worker(client: httpx.AsyncClient, args, stop: asyncio.Event, counts: Dict[str, int]):
+    while not stop.is_set():
+        response = await client.post("/auth/login", data={"username": args.username, "password": args.password})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        if response.status_code == 503:
+            await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+async def run_phase(args, storm: bool):
+    stop = asyncio.Event()
+    health, round_trips, tick_gaps = [], [], []
+    counts: Dict[str, int] = {}
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60.0, limits=limits) as client:
+        tasks = [
+            asyncio.create_task(probe_health(client, args.interval, stop, health)),
+            asyncio.create_task(probe_websocket(args.url, args.symbols, args.interval, stop, round_trips, tick_gaps)),
+        ]
+        if storm:
+            tasks += [
+                asyncio.create_task(login_worker(client, args, stop, counts))
+                for _ in range(args.concurrency)
+            ]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"Probe failed: {result!r}")
+
+    print(f"{'login storm' if storm else 'idle':12} /health   {percentiles(health)}")
+    print(f"{'':12} ws rtt    {percentiles(round_trips)}")
+    print(f"{'':12} tick gap  {percentiles(tick_gaps)}")
+    if storm:
+        print(f"{'':12} logins by status {dict(sorted(counts.items()))}, "
+              f"{sum(counts.values()) / args.duration:.1f}/s")
+
+
+async def run_remote(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60.0) as client:
+        # The storm user may already exist from an earlier run
+        await client.post("/auth/register", json={
+            "username": args.username,
+            "email": f"{args.username}@example.com",
+            "password": args.password,
+        })
+    await run_phase(args, storm=False)
+    await run_phase(args, storm=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--local", action="store_true", help="measure loop lag in-process, no server")
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between probes")
+    parser.add_argument("--symbols", nargs="+", default=["AAPL", "MSFT", "SPY"])
+    parser.add_argument("--username", default="storm_user")
+    parser.add_argument("--password", default="storm-password-1")
+    parser.add_argument("--scheme", help="passlib scheme for --local (default: the app's bcrypt)")
+    parser.add_argument("--hash-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    asyncio.run(run_local(args) if args.local else run_remote(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Check that bulk and per-portfolio risk metrics agree
+
+Logs in to a running API, fetches POST /portfolios/risk-metrics for every
+portfolio of the user and compares each result with
+GET /portfolios/{id}/risk-metrics. Exits non-zero on any mismatch.
+
+    python scripts/risk_parity.py --username alice --password secret
+
+The per-portfolio endpoint may answer from the risk result cache, so run
+this against a quiet server (or with prices that don't move, as with mock
+data) to avoid false mismatches from weights computed at different prices.
+"""
+import argparse
+import math
+import sys
+
+import httpx
+
+METRICS = [
+    'total_return', 'annualized_return', 'volatility', 'sharpe_ratio', 'sortino_ratio',
+    'beta', 'var_95', 'cvar_95', 'max_drawdown', 'information_ratio',
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--rel-tol", type=float, default=1e-9)
+    parser.add_argument("--abs-tol", type=float, default=1e-12)
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.url, timeout=60.0) as client:
+        response = client.post("/auth/login", data={"username": args.username, "password": args.password})
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        response = client.post("/portfolios/risk-metrics", json={})
+        response.raise_for_status()
+        batch = response.json()
+
+        compared = mismatches = 0
+        for batch_metrics in batch:
+            portfolio_id = batch_metrics['portfolio_id']
+            response = client.get(f"/portfolios/{portfolio_id}/risk-metrics")
+            if response.status_code == 400:
+                print(f"portfolio {portfolio_id}: skipped ({response.json().get('detail')})")
+                continue
+            response.raise_for_status()
+            single_metrics = response.json()
+            compared += 1
+
+            for name in METRICS:
+                batch_value, single_value = batch_metrics[name], single_metrics[name]
+                if not math.isclose(batch_value, single_value, rel_tol=args.rel_tol, abs_tol=args.abs_tol):
+                    mismatches += 1
+                    print(f"portfolio {portfolio_id}: {name} batch={batch_value!r} single={single_value!r}")
+
+        print(f"{compared} portfolios compared, {mismatches} mismatched metrics")
+        return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())